@@ -34,60 +34,406 @@ from mathutils import Quaternion
 
 import math
 import struct
+import json
+import functools
 import socket
+import errno
+import select
+import selectors
+import threading
 import subprocess, os
+import sys
 import time
+import collections
+import array
 
 import bpy
+import bmesh
 from bpy.props import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 add_rotations = False
 reset_locrot = False
 
+# NI mate's coordinate system in Blender's, the same axis swaps
+# parse_message does for each joint
+LOCATION_REMAP = ((1, 0, 0), (0, 0, -1), (0, 1, 0))
+ROTATION_REMAP = ((-1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 0, -1), (0, 0, 1, 0))
+
+class ObjectCache():
+    """Resolves joint names to objects once instead of looking them up for
+    every joint on every update. A cached object is checked to still have
+    the name when it's used, so renamed and removed objects are looked up
+    again. Names without an object are cached too. forget_missing() drops
+    them when an object is renamed, validate() when objects have been added
+    or removed, and clear() has to be called after undo. The settings the
+    set functions need are also read once per update.
+
+    Joints that need a new object are collected in pending, along with the
+    values of the update, and created together by create_pending_objects()
+    at the end of the update, which then sets the values."""
+
+    def __init__(self):
+        self.handles = {}
+        self.object_count = -1
+        self.auto_key = False
+        self.create = 'NONE'
+        self.pending = {}
+
+    def get(self, objects, name):
+        """Returns the object with the name, or None if there isn't one."""
+        handle = self.handles.get(name, self)
+
+        if handle is not self and handle is not None:
+            try:
+                if handle.name != name:
+                    handle = self
+            except ReferenceError:
+                handle = self
+
+        if handle is self:
+            handle = objects.get(name)
+            self.handles[name] = handle
+
+        return handle
+
+    def add(self, name, ob):
+        self.handles[name] = ob
+
+    def forget_missing(self):
+        """Drops the names without an object, so they're looked up again."""
+        for name in [name for name, handle in self.handles.items() if handle is None]:
+            del self.handles[name]
+
+    def validate(self, objects, depsgraph=None):
+        """Drops the names without an object if objects have been added or
+        removed. Adding and removing one in the same update doesn't change
+        the count, but updates the collections they're linked to."""
+        if len(objects) != self.object_count or (depsgraph is not None and depsgraph.id_type_updated('COLLECTION')):
+            self.forget_missing()
+            self.object_count = len(objects)
+
+    def clear(self):
+        self.handles.clear()
+        self.object_count = -1
+        self.pending.clear()
+
+    def read_settings(self, scene):
+        self.auto_key = scene.tool_settings.use_keyframe_insert_auto
+        self.create = scene.delicode_ni_mate_create
+
+object_cache = ObjectCache()
+
+def object_cache_validate(scene, depsgraph=None):
+    # Blender 2.80 doesn't pass the depsgraph yet
+    object_cache.validate(bpy.data.objects, depsgraph)
+
+def object_cache_renamed():
+    object_cache.forget_missing()
+
+def object_cache_clear(*args):
+    object_cache.clear()
+
+class TakeRecorder():
+    """Records the applied joint values while receiving and bakes them into
+    F-Curves when recording stops. Inserting keyframes one by one gets
+    slower as the curves grow, so the values are only appended to arrays
+    while live.
+
+    Each channel is an array of the frame number followed by the values,
+    for every recorded update. The frame numbers come from the timestamps
+    of the applied frames, counted from the frame recording started on."""
+
+    def __init__(self, fps, frame_start):
+        self.fps = fps
+        self.frame_start = frame_start
+        self.frame = frame_start
+        self.last_time = None
+        self.channels = {}
+
+    def begin_frame(self, timestamp):
+        """Sets the frame number of the values added until the next call."""
+        if self.last_time is not None and 0.0 <= timestamp - self.last_time < 1.0:
+            self.frame += (timestamp - self.last_time) * self.fps
+        elif self.last_time is not None:
+            # The timestamps jumped, e.g. the sender was restarted, so the
+            # take continues on the next frame
+            self.frame += 1.0
+
+        self.last_time = timestamp
+
+    def add(self, ob_name, data_path, values, group=None):
+        channel = self.channels.get((ob_name, data_path, group or ob_name))
+
+        if channel is None:
+            channel = array.array('f')
+            self.channels[(ob_name, data_path, group or ob_name)] = channel
+
+        channel.append(self.frame)
+        channel.extend(values)
+
+    def bake(self, objects):
+        """Adds the recorded values as keyframes to the objects' actions."""
+        for (ob_name, data_path, group), channel in self.channels.items():
+            ob = objects.get(ob_name)
+            if ob is None:
+                continue
+
+            if ob.animation_data is None:
+                ob.animation_data_create()
+            if ob.animation_data.action is None:
+                ob.animation_data.action = bpy.data.actions.new(ob_name + "Action")
+            action = ob.animation_data.action
+
+            width = len(ob.path_resolve(data_path)) + 1
+            count = len(channel) // width
+            co = array.array('f', [0.0]) * (2*count)
+            co[0::2] = channel[0::width]
+
+            for index in range(width - 1):
+                fcurve = action.fcurves.find(data_path, index=index)
+                if fcurve is None:
+                    fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+
+                # foreach_set writes all points, so the existing ones are
+                # read first and written back in front of the new ones
+                points = fcurve.keyframe_points
+                existing = array.array('f', [0.0]) * (2*len(points))
+                points.foreach_get("co", existing)
+
+                co[1::2] = channel[index+1::width]
+                points.add(count)
+                points.foreach_set("co", existing + co)
+                fcurve.update()
+
+        self.channels.clear()
+
+take_recorder = None
+
+def bake_take(path, objects, fps, frame_start):
+    """Adds the motion of a take written by TakeWriter as keyframes to the
+    objects named after its joints, starting from frame_start. The values
+    are converted the same way as when receiving, and baked the same way
+    as a recorded take."""
+    metadata, joints = read_take(path)
+    recorder = TakeRecorder(fps, frame_start)
+
+    location_matrix = 10*numpy.array(LOCATION_REMAP, dtype=numpy.float32).T
+    rotation_matrix = numpy.array(ROTATION_REMAP, dtype=numpy.float32).T
+
+    for name, rows in joints.items():
+        frames = (frame_start + fps*rows[:, 0]).tolist()
+        locations = (rows[:, 1:4] @ location_matrix).tolist()
+        rotations = (rows[:, 4:8] @ rotation_matrix).tolist()
+
+        for frame, location, rotation in zip(frames, locations, rotations):
+            recorder.frame = frame
+
+            if not math.isnan(location[0]):
+                recorder.add(name, "location", location)
+            if not math.isnan(rotation[0]):
+                recorder.add(name, "rotation_quaternion", rotation)
+
+        ob = objects.get(name)
+        if ob is not None and (name, "rotation_quaternion", name) in recorder.channels:
+            ob.rotation_mode = 'QUATERNION'
+
+    recorder.bake(objects)
+
 def set_location(objects, ob_name, vec, originals):
-    if ob_name in objects.keys():
-        if ob_name not in originals.keys():
-            originals[ob_name] = objects[ob_name].location.copy()
+    ob = object_cache.get(objects, ob_name)
+
+    if ob is not None:
+        if ob_name not in originals:
+            originals[ob_name] = ob.location.copy()
 
-        objects[ob_name].location = 10*vec
+        ob.location = 10*vec
         
-        if(bpy.context.scene.tool_settings.use_keyframe_insert_auto):
-            objects[ob_name].keyframe_insert(data_path="location")
-
-    elif bpy.context.scene.delicode_ni_mate_create != 'NONE':
-        ob_type = bpy.context.scene.delicode_ni_mate_create
-        if(ob_type == 'EMPTIES'):
-            bpy.ops.object.add()
-            bpy.context.object.empty_display_size = 0.2
-        elif(ob_type == 'SPHERES'):
-            bpy.ops.mesh.primitive_ico_sphere_add()
+        if take_recorder is not None:
+            take_recorder.add(ob_name, "location", ob.location)
+        elif(object_cache.auto_key):
+            ob.keyframe_insert(data_path="location")
+
+    elif object_cache.create != 'NONE':
+        object_cache.pending[ob_name] = [(set_location, vec.copy(), originals)]
+
+def primitive_mesh(ob_type):
+    """Returns the mesh shared by all created objects of the type, creating
+    it the first time. The sizes are the defaults of the add operators."""
+    name = "NIMate_" + ob_type.lower()
+    mesh = bpy.data.meshes.get(name)
+
+    if mesh is None:
+        mesh = bpy.data.meshes.new(name)
+        bm = bmesh.new()
+        if(ob_type == 'SPHERES'):
+            bmesh.ops.create_icosphere(bm, subdivisions=2, radius=1.0)
         elif(ob_type == 'CUBES'):
-            bpy.ops.mesh.primitive_cube_add()
+            bmesh.ops.create_cube(bm, size=2.0)
+        bm.to_mesh(mesh)
+        bm.free()
 
-        ob = bpy.context.object
-        ob.name = ob_name
-        ob.location = 10*vec
+    return mesh
+
+def create_pending_objects():
+    """Creates the objects for all joints that set_location found missing
+    during the update, and sets their values of the update. Going through
+    bpy.data instead of the add operators avoids a scene update and a
+    context change for every object."""
+    if not object_cache.pending:
+        return
+
+    ob_type = object_cache.create
+    data = None if ob_type == 'EMPTIES' else primitive_mesh(ob_type)
+    collection = bpy.data.collections['NIMate']
+
+    for ob_name, values in object_cache.pending.items():
+        ob = bpy.data.objects.new(ob_name, data)
+        if data is None:
+            ob.empty_display_size = 0.2
+
+        collection.objects.link(ob)
 
-        bpy.data.collections['NIMate'].objects.link(ob)
-        bpy.data.collections[0].objects.unlink(ob)
+        object_cache.add(ob_name, ob)
 
-        if(bpy.context.scene.tool_settings.use_keyframe_insert_auto):
-            objects[ob_name].keyframe_insert(data_path="location")
+        # Set the same way as on existing objects, so they're keyed or
+        # recorded to the take like the rest of the frame
+        for set_func, value, originals in values:
+            set_func(bpy.data.objects, ob_name, value, originals)
+
+    object_cache.pending.clear()
 
 def set_rotation(objects, ob_name, quat, originals):
-    if ob_name in objects.keys():
-        objects[ob_name].rotation_mode = 'QUATERNION'
+    ob = object_cache.get(objects, ob_name)
+
+    if ob is not None:
+        ob.rotation_mode = 'QUATERNION'
 
-        if ob_name not in originals.keys():
-            originals[ob_name] = objects[ob_name].rotation_quaternion.copy()
+        if ob_name not in originals:
+            originals[ob_name] = ob.rotation_quaternion.copy()
 
         if add_rotations:
-            objects[ob_name].rotation_quaternion = quat @ originals[ob_name]
+            ob.rotation_quaternion = quat @ originals[ob_name]
         else:
-            objects[ob_name].rotation_quaternion = quat
+            ob.rotation_quaternion = quat
         
-        if(bpy.context.scene.tool_settings.use_keyframe_insert_auto):
-            objects[ob_name].keyframe_insert(data_path="rotation_quaternion")
+        if take_recorder is not None:
+            take_recorder.add(ob_name, "rotation_quaternion", ob.rotation_quaternion)
+        elif(object_cache.auto_key):
+            ob.keyframe_insert(data_path="rotation_quaternion")
+
+    elif ob_name in object_cache.pending:
+        # The object is created with the location at the end of the update
+        object_cache.pending[ob_name].append((set_rotation, quat.copy(), originals))
+
+class ArmatureDriver():
+    """Drives the pose bones of an armature that are named after NI mate
+    joints, instead of objects. The bone hierarchy and rest orientations
+    are read once at start. The set functions only collect the frame, and
+    apply() then updates all bones in one pass from the root down, solving
+    each driven bone's rotation against the pose of its parent.
+
+    The received rotations are in world space. With add_rotations they're
+    added to each bone's rest orientation, otherwise they replace it, the
+    same as for objects."""
+
+    def __init__(self, armature):
+        self.armature = armature
+        self.world_inverted = armature.matrix_world.inverted()
+        self.world_rotation_inverted = armature.matrix_world.to_quaternion().inverted()
+        self.location_dict = {}
+        self.rotation_dict = {}
+        self.originals = {}
+
+        # (pose bone, parent index, rest in parent, its inverse, rest
+        # orientation, its inverse, rest head), parents before children
+        self.bones = []
+        self.names = {}
+
+        stack = [bone for bone in armature.data.bones if bone.parent is None]
+
+        while len(stack) > 0:
+            bone = stack.pop()
+            rest = bone.matrix_local.to_quaternion()
+
+            if bone.parent is None:
+                parent = -1
+                local = rest
+            else:
+                parent = self.names[bone.parent.name]
+                local = self.bones[parent][5] @ rest
+
+            self.names[bone.name] = len(self.bones)
+            self.bones.append((armature.pose.bones[bone.name], parent, local, local.inverted(), rest, rest.inverted(), bone.head_local.copy()))
+            stack.extend(bone.children)
+
+    def set_location(self, objects, name, vec, originals):
+        self.location_dict[name] = vec
+
+    def set_rotation(self, objects, name, quat, originals):
+        self.rotation_dict[name] = quat
+
+    def store_original(self, pose_bone):
+        if pose_bone.name not in self.originals:
+            self.originals[pose_bone.name] = (pose_bone.location.copy(), pose_bone.rotation_quaternion.copy(), pose_bone.rotation_mode)
+            pose_bone.rotation_mode = 'QUATERNION'
+
+    def apply(self):
+        """Updates the bones from the collected frame."""
+        if len(self.location_dict) == 0 and len(self.rotation_dict) == 0:
+            return
+
+        poses = []
+        identity = Quaternion()
+
+        for pose_bone, parent, local, local_inverted, rest, rest_inverted, head in self.bones:
+            parent_pose = poses[parent] if parent >= 0 else identity
+            quat = self.rotation_dict.get(pose_bone.name)
+
+            if quat is not None:
+                self.store_original(pose_bone)
+
+                pose = self.world_rotation_inverted @ quat
+                if add_rotations:
+                    pose = pose @ rest
+
+                pose_bone.rotation_quaternion = local_inverted @ parent_pose.inverted() @ pose
+
+                if take_recorder is not None:
+                    take_recorder.add(self.armature.name, pose_bone.path_from_id("rotation_quaternion"), pose_bone.rotation_quaternion, pose_bone.name)
+                elif(object_cache.auto_key):
+                    pose_bone.keyframe_insert(data_path="rotation_quaternion")
+            else:
+                pose = parent_pose @ local @ pose_bone.matrix_basis.to_quaternion()
+
+            poses.append(pose)
+
+            vec = self.location_dict.get(pose_bone.name)
+
+            # Child bones follow their parents, only the roots are moved
+            if vec is not None and parent < 0:
+                self.store_original(pose_bone)
+
+                pose_bone.location = rest_inverted @ (self.world_inverted @ (10*vec) - head)
+
+                if take_recorder is not None:
+                    take_recorder.add(self.armature.name, pose_bone.path_from_id("location"), pose_bone.location, pose_bone.name)
+                elif(object_cache.auto_key):
+                    pose_bone.keyframe_insert(data_path="location")
+
+        self.location_dict.clear()
+        self.rotation_dict.clear()
+
+    def reset(self):
+        for name, (location, rotation, rotation_mode) in self.originals.items():
+            pose_bone = self.armature.pose.bones[name]
+            pose_bone.location = location
+            pose_bone.rotation_quaternion = rotation
+            pose_bone.rotation_mode = rotation_mode
 
 def rotation_from_matrix(m00, m01, m02, m10, m11, m12, m20, m21, m22):
     mat = Matrix()
@@ -104,97 +450,690 @@ def rotation_from_matrix(m00, m01, m02, m10, m11, m12, m20, m21, m22):
     return mat.to_quaternion()
             
 class OSC():
-    def readByte(data):
-        length   = data.find(b'\x00')
-        nextData = int(math.ceil((length+1) / 4.0) * 4)
-        return (data[0:length], data[nextData:])
+    # The readers take a memoryview of the whole datagram and an offset into
+    # it, and return the decoded value together with the offset of the next
+    # field, so decoding a message never copies the rest of the datagram.
+    def readByte(data, offset):
+        # OSC strings are padded with nulls to a multiple of four bytes, so
+        # the last byte of the word containing the terminator is always null.
+        end = offset + 3
+        while data[end] != 0:
+            end += 4
+        length = end - 3
+        while data[length] != 0:
+            length += 1
+        return (data[offset:length].tobytes(), end + 1)
 
     
-    def readString(data):
-        length   = str(data).find("\0")
-        nextData = int(math.ceil((length+1) / 4.0) * 4)
-        return (data[0:length], data[nextData:])
-    
+    def readString(data, offset):
+        string, nextData = OSC.readByte(data, offset)
+        return (string.decode("utf-8"), nextData)
     
-    def readBlob(data):
-        length   = struct.unpack(">i", data[0:4])[0]
-        nextData = int(math.ceil((length) / 4.0) * 4) + 4
-        return (data[4:length+4], data[nextData:])
     
+    def readBlob(data, offset):
+        length   = struct.unpack_from(">i", data, offset)[0]
+        nextData = offset + int(math.ceil((length) / 4.0) * 4) + 4
+        return (data[offset+4:offset+length+4].tobytes(), nextData)
     
-    def readInt(data):
-        if(len(data)<4):
-            print("Error: too few bytes for int", data, len(data))
-            rest = data
-            integer = 0
-        else:
-            integer = struct.unpack(">i", data[0:4])[0]
-            rest    = data[4:]
     
-        return (integer, rest)
+    def readInt(data, offset):
+        """Raises struct.error if there are fewer than 4 bytes left."""
+        return (struct.unpack_from(">i", data, offset)[0], offset+4)
     
     
-    def readLong(data):
+    def readLong(data, offset):
         """Tries to interpret the next 8 bytes of the data
         as a 64-bit signed integer."""
-        high, low = struct.unpack(">ll", data[0:8])
-        big = (long(high) << 32) + low
-        rest = data[8:]
-        return (big, rest)
+        big = struct.unpack_from(">q", data, offset)[0]
+        return (big, offset+8)
+    
+    
+    def readTimetag(data, offset):
+        """Reads a 64-bit NTP timetag, seconds since 1900 in the high 32 bits
+        and the fraction of a second in the low 32 bits."""
+        timetag = struct.unpack_from(">Q", data, offset)[0]
+        return (timetag, offset+8)
     
+    def timetagToSeconds(timetag):
+        """Converts an NTP timetag to seconds, or None for the special
+        timetag 1 meaning "immediately"."""
+        if timetag == 1:
+            return None
+        return (timetag >> 32) + (timetag & 0xffffffff) / 4294967296.0
     
-    def readDouble(data):
+    def readDouble(data, offset):
         """Tries to interpret the next 8 bytes of the data
         as a 64-bit double float."""
-        floater = struct.unpack(">d", data[0:8])
-        big = float(floater[0])
-        rest = data[8:]
-        return (big, rest)
+        big = struct.unpack_from(">d", data, offset)[0]
+        return (big, offset+8)
     
     
     
-    def readFloat(data):
-        if(len(data)<4):
-            print("Error: too few bytes for float", data, len(data))
-            rest = data
-            float = 0
-        else:
-            float = struct.unpack(">f", data[0:4])[0]
-            rest  = data[4:]
-    
-        return (float, rest)
+    def readFloat(data, offset):
+        """Raises struct.error if there are fewer than 4 bytes left."""
+        return (struct.unpack_from(">f", data, offset)[0], offset+4)
     
-    def decodeOSC(data):
+    @functools.lru_cache(maxsize=32)
+    def compileTypetags(typetags):
+        """Returns a struct.Struct that unpacks all the arguments described
+        by the typetags in one call, or None if the arguments include
+        variable length strings or blobs. NI mate only sends a handful of
+        different typetags, so the compiled structs are cached."""
+        tags = typetags[1:].decode("utf-8")
+        if any(tag not in "ifd" for tag in tags):
+            return None
+        return struct.Struct(">" + tags)
+
+    def decodeArguments(data, offset, typetags, decoded):
         table = { "i" : OSC.readInt, "f" : OSC.readFloat, "s" : OSC.readString, "b" : OSC.readBlob, "d" : OSC.readDouble }
+        for tag in typetags[1:]:
+            value, offset = table[chr(tag)](data, offset)
+            decoded.append(value)
+        return offset
+
+    def bundleMessages(decoded):
+        """Yields the messages of a decoded bundle in the order they were
+        sent, including the messages of nested bundles."""
+        for element in decoded[2:]:
+            if len(element) == 0:
+                continue
+            if element[0] == b"#bundle":
+                yield from OSC.bundleMessages(element)
+            else:
+                yield element
+
+    def decodeOSC(data):
+        data = memoryview(data)
         decoded = []
-        address,  rest = OSC.readByte(data)
         typetags = ""
-        
-        if address == "#bundle":
-            time, rest = readLong(rest)
-            decoded.append(address)
-            decoded.append(time)
-            while len(rest)>0:
-                length, rest = OSC.readInt(rest)
-                decoded.append(OSC.decodeOSC(rest[:length]))
-                rest = rest[length:]
-    
-        elif len(rest) > 0:
-            typetags, rest = OSC.readByte(rest)
-            decoded.append(address)
-            decoded.append(typetags)
+
+        try:
+            address, offset = OSC.readByte(data, 0)
             
-            if len(typetags) > 0:        
-                if typetags[0] == ord(','):
-                    for tag in typetags[1:]:
-                        value, rest = table[chr(tag)](rest)
-                        decoded.append(value)
-                else:
-                    print("Oops, typetag lacks the magic")
+            if address == b"#bundle":
+                timetag, offset = OSC.readTimetag(data, offset)
+                decoded.append(address)
+                decoded.append(timetag)
+                while offset < len(data):
+                    length, offset = OSC.readInt(data, offset)
+                    if length <= 0 or length % 4 != 0 or offset+length > len(data):
+                        print("Error: invalid OSC bundle element size", length)
+                        break
+                    decoded.append(OSC.decodeOSC(data[offset:offset+length]))
+                    offset += length
+        
+            elif offset < len(data):
+                typetags, offset = OSC.readByte(data, offset)
+                decoded.append(address)
+                decoded.append(typetags)
+                
+                if len(typetags) > 0:
+                    if typetags[0] == ord(','):
+                        compiled = OSC.compileTypetags(typetags)
+                        if compiled is not None and len(data)-offset >= compiled.size:
+                            decoded.extend(compiled.unpack_from(data, offset))
+                        else:
+                            OSC.decodeArguments(data, offset, typetags, decoded)
+                    else:
+                        print("Oops, typetag lacks the magic")
+        except (IndexError, struct.error):
+            print("Error: truncated OSC message", data.tobytes())
     
         return decoded
 
- 
+class DatagramReader():
+    """Drains a non-blocking UDP socket into one preallocated buffer with
+    recv_into, so receiving doesn't allocate a new bytes object for every
+    datagram. At most max_packets datagrams are read per drain to bound the
+    time spent on a tick, the rest stay queued in the socket for the next
+    tick. Datagrams larger than max_packet_size are counted as truncated and
+    dropped instead of being decoded partially. With a capture set, every
+    accepted datagram is also written to it as it's read."""
+
+    # The errno of a datagram too large for the read, POSIX and Windows
+    MSGSIZE_ERRORS = (errno.EMSGSIZE, getattr(errno, "WSAEMSGSIZE", errno.EMSGSIZE))
+
+    def __init__(self, sock, max_packets=1024, max_packet_size=16384, recv_buffer_size=0):
+        self.sock = sock
+        self.max_packets = max_packets
+        self.max_packet_size = max_packet_size
+
+        # A lower SO_RCVBUF bounds how much stale data the socket can queue
+        # while the host application is stalled
+        if recv_buffer_size > 0:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer_size)
+        self.recv_buffer_size = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+        # Reading one byte more than the largest accepted datagram tells
+        # truncated datagrams apart from ones that fit exactly
+        self.buffer = bytearray(max(1024*1024, 4*(max_packet_size+1)))
+        self.view = memoryview(self.buffer)
+
+        self.packets = 0
+        self.truncated = 0
+        self.overflows = 0
+
+        self.capture = None
+        self.capture_port = 0
+
+    def drain(self):
+        """Returns memoryviews of the datagrams waiting in the socket. The
+        views point to the shared buffer and are only valid until the next
+        call."""
+        packets = []
+        offset = 0
+        read_size = self.max_packet_size + 1
+
+        while len(packets) < self.max_packets and offset + read_size <= len(self.buffer):
+            try:
+                size = self.sock.recv_into(self.view[offset:offset+read_size], read_size)
+            except BlockingIOError:
+                # Nothing left to read in the non-blocking socket
+                self.packets += len(packets)
+                return packets
+            except ConnectionResetError:
+                # Windows reports an ICMP port unreachable as a reset on the
+                # next receive, the socket itself still works
+                continue
+            except OSError as e:
+                # Windows fails the receive of a datagram larger than the
+                # read size instead of truncating it
+                if e.errno in self.MSGSIZE_ERRORS:
+                    self.truncated += 1
+                    continue
+                raise
+
+            if size > self.max_packet_size:
+                self.truncated += 1
+                continue
+
+            packets.append(self.view[offset:offset+size])
+            offset += size
+
+            if self.capture is not None:
+                self.capture.write(self.capture_port, packets[-1])
+
+        # The budget ran out before the socket was empty
+        self.overflows += 1
+        self.packets += len(packets)
+        return packets
+
+    def stats(self):
+        return "%d packets, %d truncated, %d overflows, %d byte socket buffer" % (self.packets, self.truncated, self.overflows, self.recv_buffer_size)
+
+
+class PacketCapture():
+    """Appends every received datagram to a binary log with its arrival
+    time, so that a session can be replayed later with
+    Tools/osc_replay.py. The file starts with MAGIC and is followed by
+    entries of a little-endian double time, an unsigned short port and an
+    unsigned int size, and then size bytes of the datagram. The times are
+    seconds on the monotonic clock since the session started. Each session
+    begins with an entry of size 0 whose time is the wall clock time it
+    started at, so several sessions can be appended to one file.
+
+    The receivers of all ports share one capture, so writes are locked.
+    They're buffered and flushed to the file once a second."""
+
+    MAGIC = b"NIMCAP1\x00"
+    ENTRY = struct.Struct("<dHI")
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.file = open(path, "ab")
+
+        if self.file.tell() == 0:
+            self.file.write(self.MAGIC)
+        self.file.write(self.ENTRY.pack(time.time(), 0, 0))
+
+        self.start = time.perf_counter()
+        self.flush_interval = flush_interval
+        self.last_flush = self.start
+        self.lock = threading.Lock()
+
+        self.packets = 0
+        self.bytes = 0
+
+    def write(self, port, data):
+        now = time.perf_counter()
+
+        with self.lock:
+            if self.file is None:
+                return
+
+            self.file.write(self.ENTRY.pack(now - self.start, port, len(data)))
+            self.file.write(data)
+            self.packets += 1
+            self.bytes += len(data)
+
+            if now - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def stats(self):
+        return "%d packets, %d bytes to %s" % (self.packets, self.bytes, self.path)
+
+class TakeWriter():
+    """Streams the received joints to a take on disk while receiving, so a
+    long session never has to fit in memory, and the take can be baked
+    later in any of the NI mate plugins. A take is a directory with
+    take.json, holding the metadata and the joint table, and one file of
+    float32 rows per joint. Each row is the time in seconds from the start
+    of the take, the location x, y, z and the rotation w, x, y, z in the
+    coordinates NI mate sends, with NaN for a value the joint didn't have.
+    read_take() opens the rows as numpy.memmap arrays.
+
+    location_func and rotation_func convert the joint values of the plugin
+    back to NI mate's coordinates. An existing take isn't overwritten, a
+    number is added to the path instead. The files are flushed and the
+    joint table is rewritten once a second. The receivers of several ports
+    can share a writer, also from their network threads."""
+
+    VERSION = 1
+    COLUMNS = ("time", "x", "y", "z", "qw", "qx", "qy", "qz")
+    ROW = struct.Struct("<8f")
+    NO_LOCATION = (float("nan"),)*3
+    NO_ROTATION = (float("nan"),)*4
+
+    def __init__(self, path, application, location_func=tuple, rotation_func=tuple, flush_interval=1.0):
+        path = os.path.normpath(path)
+        self.path = path
+        number = 1
+
+        while os.path.exists(os.path.join(self.path, "take.json")):
+            number += 1
+            self.path = "%s_%d" % (path, number)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.metadata = {
+            "format": "NI mate take",
+            "version": self.VERSION,
+            "application": application,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "columns": list(self.COLUMNS),
+            "duration": 0.0,
+            "joints": [],
+        }
+
+        self.location_func = location_func
+        self.rotation_func = rotation_func
+        self.files = {}
+        self.start = None
+        self.rows = 0
+        self.lock = threading.Lock()
+
+        self.flush_interval = flush_interval
+        self.last_flush = time.perf_counter()
+        self.write_table()
+
+    def write_table(self):
+        # Replaced in one go, so a reader never sees a partial table
+        temp_path = os.path.join(self.path, "take.json.tmp")
+
+        with open(temp_path, "w") as f:
+            json.dump(self.metadata, f, indent=1)
+
+        os.replace(temp_path, os.path.join(self.path, "take.json"))
+
+    def write_row(self, name, seconds, location, rotation):
+        f = self.files.get(name)
+
+        if f is None:
+            filename = "joint%03d.f4" % len(self.files)
+            f = open(os.path.join(self.path, filename), "wb")
+            self.files[name] = f
+            self.metadata["joints"].append({"name": name, "file": filename})
+            self.write_table()
+
+        f.write(self.ROW.pack(seconds, *(location + rotation)))
+        self.rows += 1
+
+    def add_frame(self, timestamp, location_dict, rotation_dict, skip=()):
+        """Writes a row for every joint of a received frame, timestamp is in
+        seconds on any clock that doesn't jump. The names in skip, those of
+        one value messages, aren't joints and are left out."""
+        with self.lock:
+            if self.start is None:
+                self.start = timestamp
+            seconds = timestamp - self.start
+
+            for name, location in location_dict.items():
+                if name not in skip:
+                    rotation = rotation_dict.get(name)
+                    self.write_row(name, seconds, tuple(self.location_func(location)), self.NO_ROTATION if rotation is None else tuple(self.rotation_func(rotation)))
+
+            for name, rotation in rotation_dict.items():
+                if name not in location_dict:
+                    self.write_row(name, seconds, self.NO_LOCATION, tuple(self.rotation_func(rotation)))
+
+            self.metadata["duration"] = seconds
+
+            if time.perf_counter() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+        self.write_table()
+        self.last_flush = time.perf_counter()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+
+            for f in self.files.values():
+                f.close()
+            self.files.clear()
+
+    def stats(self):
+        return "%d rows of %d joints to %s" % (self.rows, len(self.metadata["joints"]), self.path)
+
+def read_take(path):
+    """Opens a take written by TakeWriter. Returns its metadata and a dict
+    of read-only numpy.memmap arrays of shape (rows, 8) keyed by joint
+    name, with the columns in TakeWriter.COLUMNS. A row that was cut off
+    while the take was written is left out."""
+    with open(os.path.join(path, "take.json")) as f:
+        metadata = json.load(f)
+
+    if metadata.get("format") != "NI mate take" or metadata.get("version", 0) > TakeWriter.VERSION:
+        raise ValueError("%s isn't a supported NI mate take" % path)
+
+    joints = {}
+
+    for joint in metadata["joints"]:
+        filename = os.path.join(path, joint["file"])
+        rows = os.path.getsize(filename) // TakeWriter.ROW.size
+
+        if rows > 0:
+            joints[joint["name"]] = numpy.memmap(filename, dtype="<f4", mode="r", shape=(rows, len(TakeWriter.COLUMNS)))
+
+    return (metadata, joints)
+
+class JointRecord():
+    """A joint's location and rotation. The records are allocated once per
+    joint and updated in place from every frame, so receiving doesn't
+    create new objects for the garbage collector to track."""
+    __slots__ = ("name", "location", "rotation")
+
+    def __init__(self, name):
+        self.name = name
+        self.location = Vector((0.0, 0.0, 0.0))
+        self.rotation = Quaternion()
+
+class JointPool():
+    """The joint records of one frame, keyed by the raw OSC address so
+    that each joint name is decoded and interned only once. location_dict
+    and rotation_dict hold the records set since begin() and are cleared
+    instead of replaced. The values are overwritten by the next frame, so
+    anything that keeps them has to use copy_dicts()."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.records = {}
+        self.location_dict = {}
+        self.rotation_dict = {}
+
+    def record(self, address):
+        record = self.records.get(address)
+
+        if record is None:
+            record = JointRecord(sys.intern(self.prefix + str(address, "utf-8")))
+            self.records[address] = record
+
+        return record
+
+    def location(self, address):
+        record = self.record(address)
+        self.location_dict[record.name] = record.location
+        return record.location
+
+    def rotation(self, address):
+        record = self.record(address)
+        self.rotation_dict[record.name] = record.rotation
+        return record.rotation
+
+    def begin(self):
+        self.location_dict.clear()
+        self.rotation_dict.clear()
+
+    def copy_dicts(self):
+        return (dict((key, value.copy()) for key, value in self.location_dict.items()),
+                dict((key, value.copy()) for key, value in self.rotation_dict.items()))
+
+class FrameBuffer():
+    """Double buffer handing complete skeleton frames from the network thread
+    to the UI thread. The network thread fills its back frame and publishes
+    it by swapping it to the front, the UI thread takes the front frame when
+    it updates. Frames published between two updates replace each other, so
+    the UI thread always gets the newest one."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.front = None
+        self.expressions = []
+        self.published = 0
+        self.skipped = 0
+
+    def publish(self, location_dict, rotation_dict):
+        with self.lock:
+            if self.front is not None:
+                self.skipped += 1
+            self.front = (location_dict, rotation_dict)
+            self.published += 1
+
+    def add_expression(self, to_evaluate):
+        with self.lock:
+            self.expressions.append(to_evaluate)
+
+    def swap(self):
+        """Returns the newest published frame, or None if nothing has been
+        published since the last swap, and the queued @ and ? expressions."""
+        with self.lock:
+            frame = self.front
+            expressions = self.expressions
+            self.front = None
+            self.expressions = []
+        return (frame, expressions)
+
+class JitterBuffer():
+    """Buffers complete skeleton frames with their arrival times, or the
+    sender's bundle timetags, and plays them back with a fixed delay by
+    interpolating between the two frames around the delayed time. A longer
+    delay hides more network and timer jitter at the cost of latency.
+    Locations are interpolated with lerp_func and rotations with
+    slerp_func, both called as func(a, b, t)."""
+
+    def __init__(self, delay, lerp_func, slerp_func, max_frames=120):
+        self.delay = delay
+        self.lerp = lerp_func
+        self.slerp = slerp_func
+        self.frames = collections.deque(maxlen=max_frames)
+        self.lock = threading.Lock()
+        self.clock_offset = None
+
+        self.received = 0
+        self.dropped = 0
+        self.samples = 0
+        self.underruns = 0
+
+        # The time of the frame sample() returned last, which stays the
+        # same while a frame is held
+        self.sampled_time = None
+
+    def add(self, location_dict, rotation_dict, timestamp=None):
+        """Adds a complete frame. The timestamp is the sender's time in
+        seconds, without it the frame is timed by its arrival."""
+        now = time.perf_counter()
+
+        if timestamp is not None:
+            # The smallest difference between the local and sender clocks
+            # belongs to the least delayed frame. A large jump means the
+            # sender's clock was reset.
+            offset = now - timestamp
+            if self.clock_offset is None or offset < self.clock_offset or offset - self.clock_offset > 1.0:
+                self.clock_offset = offset
+            now = timestamp + self.clock_offset
+
+        with self.lock:
+            self.received += 1
+
+            if len(self.frames) > 0 and now <= self.frames[-1][0]:
+                # Arrived out of order
+                self.dropped += 1
+                return
+
+            self.frames.append((now, location_dict, rotation_dict))
+
+    def sample(self):
+        """Returns the location and rotation dicts for the current time
+        minus the delay, or None if no frames have been received."""
+        target = time.perf_counter() - self.delay
+
+        with self.lock:
+            frames = self.frames
+            while len(frames) > 1 and frames[1][0] <= target:
+                frames.popleft()
+
+            if len(frames) == 0:
+                return None
+
+            self.samples += 1
+            time0, location0, rotation0 = frames[0]
+
+            if target <= time0:
+                self.sampled_time = time0
+                return (location0, rotation0)
+
+            if len(frames) == 1:
+                # No newer frame arrived in time, hold the last one
+                self.underruns += 1
+                self.sampled_time = time0
+                return (location0, rotation0)
+
+            time1, location1, rotation1 = frames[1]
+            self.sampled_time = target
+
+        t = (target - time0) / (time1 - time0)
+
+        location_dict = {}
+        for key, value in location1.items():
+            previous = location0.get(key)
+            location_dict[key] = value if previous is None else self.lerp(previous, value, t)
+
+        rotation_dict = {}
+        for key, value in rotation1.items():
+            previous = rotation0.get(key)
+            rotation_dict[key] = value if previous is None else self.slerp(previous, value, t)
+
+        return (location_dict, rotation_dict)
+
+    def stats(self):
+        return "%d frames, %d dropped, %d underruns in %d updates with %d ms delay" % (self.received, self.dropped, self.underruns, self.samples, 1000*self.delay)
+
+class Predictor():
+    """Extrapolates each joint forward by horizon seconds from its velocity
+    over the last few complete frames, to hide the latency between the
+    sensor and the viewport. The velocity is the change between the oldest
+    and newest remembered frame, so extrapolating reuses the interpolation
+    functions with a factor above 1. Joints whose rotation is_lost_func
+    reports as untracked are applied as received and their history is
+    cleared, so a joint doesn't keep moving after tracking is lost."""
+
+    def __init__(self, horizon, lerp_func, slerp_func, is_lost_func, history=3, max_gap=0.25, max_factor=2.0):
+        self.horizon = horizon
+        self.lerp = lerp_func
+        self.slerp = slerp_func
+        self.is_lost = is_lost_func
+        self.history = history
+        self.max_gap = max_gap
+        self.max_factor = max_factor
+
+        self.locations = {}
+        self.rotations = {}
+
+        self.frames = 0
+        self.clamped = 0
+
+        self.last_time = None
+        self.last_prediction = None
+
+    def extrapolate(self, samples, key, now, value, func):
+        history = samples.get(key)
+
+        # After a gap the old frames say nothing about the current velocity
+        if history is None or now - history[-1][0] > self.max_gap:
+            history = collections.deque(maxlen=self.history)
+            samples[key] = history
+
+        history.append((now, value))
+        time0, value0 = history[0]
+
+        if now <= time0:
+            return value
+
+        # Extrapolating far beyond the measured interval amplifies noise
+        # more than it hides latency
+        t = 1.0 + min(self.horizon / (now - time0), self.max_factor)
+        return func(value0, value, t)
+
+    def predict(self, location_dict, rotation_dict, now):
+        """Returns new location and rotation dicts predicted from a complete
+        frame received at now, in seconds on the perf_counter clock. A frame
+        that isn't newer than the last one, such as a held frame, would
+        stop the joints, so the last prediction is returned for it."""
+        if self.last_time is not None and now <= self.last_time:
+            return self.last_prediction
+
+        self.last_time = now
+        self.frames += 1
+
+        lost = set()
+        predicted_rotations = {}
+        for key, value in rotation_dict.items():
+            if self.is_lost(value):
+                lost.add(key)
+                self.locations.pop(key, None)
+                self.rotations.pop(key, None)
+                self.clamped += 1
+                predicted_rotations[key] = value
+            else:
+                predicted_rotations[key] = self.extrapolate(self.rotations, key, now, value, self.slerp)
+
+        predicted_locations = {}
+        for key, value in location_dict.items():
+            if key in lost:
+                predicted_locations[key] = value
+            else:
+                predicted_locations[key] = self.extrapolate(self.locations, key, now, value, self.lerp)
+
+        self.last_prediction = (predicted_locations, predicted_rotations)
+        return self.last_prediction
+
+    def stats(self):
+        return "%d frames, %d lost joints held with %d ms horizon" % (self.frames, self.clamped, 1000*self.horizon)
+
+def extrapolate_quaternion(a, b, t):
+    """Same as a.slerp(b, t), but also for the factors above 1 the Predictor
+    uses, which Quaternion.slerp rejects. The rotation from a to b is
+    scaled by t - 1 in axis-angle form and applied on top of b."""
+    delta = b @ a.inverted()
+
+    # Take the shorter way around
+    if delta.w < 0.0:
+        delta.negate()
+
+    axis, angle = delta.to_axis_angle()
+    return Quaternion(axis, angle*(t - 1.0)) @ b
+
 class NImateReceiver():
     original_rotations = {}
     original_locations = {}
@@ -205,148 +1144,359 @@ class NImateReceiver():
     location_dict = {}
     rotation_dict = {}
     
-    next_location_dict = {}
-    next_rotation_dict = {}
-    next_sync = False
+    pool = None
+    next_pool = None
+    value_names = None
+
+    thread = None
+    frames = None
+    jitter = None
+    predictor = None
+    synced = False
+    prefix = ""
+    take = None
+
+    def evaluate(self, to_evaluate):
+        if self.thread is not None and threading.current_thread() is self.thread:
+            # bpy can only be used from the UI thread
+            self.frames.add_expression(to_evaluate)
+            return
 
-    def run(self, objects, set_location_func, set_rotation_func):
-        
-        apply_location_dict = {}
-        apply_rotation_dict = {}
-        
-        receive = True
-        
-        sync = False
-        
         try:
-            data = self.sock.recv( 1024 )
-        except:
-            data = None
-
-            if self.next_sync:            
-                apply_location_dict = self.next_location_dict.copy()
-                apply_rotation_dict = self.next_rotation_dict.copy()
-                self.next_location_dict = {}
-                self.next_rotation_dict = {}
-                self.next_sync = False
-                sync = True
-            
-            receive = False
-            
-        trash = data
-        while(receive):
-            data = trash
-            
+            print(exec(to_evaluate))
+        except Exception as e:
+            print(to_evaluate)
+            print(str(e))
+
+    def parse_message(self, decoded, location_dict, rotation_dict):
+        """Stores the joint data of a decoded OSC message in the dicts.
+        Returns True if the message is the sync message ending a frame."""
+        ob_name = str(decoded[0], "utf-8")
+
+        if (ob_name.startswith("@")):
+            # Something to play with:
+            # values that begin with a @ are python expressions,
+            # and there is one parameter after the address in the OSC message
+            # if you set something such as
+            # bpy.data.objects"['Cube']".location.x= {V}
+            # into a OSC path for, say, a face shape smile controller you can move an object by smiling
+            to_evaluate = ob_name[1:]
+            to_evaluate += str(decoded[2])
+            self.evaluate(to_evaluate)
+        elif (ob_name.startswith("?")):
+            # This one could be used for something such as mapping "thumbs up" gesture for rendering
+            # Add the following path to a gesture controller OSC path
+            # ?bpy.ops.render.render()
+            to_evaluate = ob_name[1:]
+            self.evaluate(to_evaluate)
+        elif len(decoded) == 3: #one value
+            if ob_name == "/NI_mate_sync":
+                return True
+
+            location_dict[self.prefix + ob_name] = Vector([decoded[2], 0, 0])
+            self.value_names.add(self.prefix + ob_name)
+
+        elif len(decoded) == 5: #location
+            location_dict[self.prefix + ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
+
+        elif len(decoded) == 6: #quaternion
+            rotation_dict[self.prefix + ob_name] = Quaternion((-decoded[2], decoded[3], -decoded[5], decoded[4]))
+
+        elif len(decoded) == 9: #location & quaternion
+            location_dict[self.prefix + ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
+            rotation_dict[self.prefix + ob_name] = Quaternion((-decoded[5], decoded[6], -decoded[8], decoded[7]))
+
+        return False
+
+    def parse_bundle(self, decoded):
+        """Returns the location and rotation dicts of the skeleton frame in
+        a decoded bundle."""
+        location_dict = {}
+        rotation_dict = {}
+
+        for message in OSC.bundleMessages(decoded):
+            self.parse_message(message, location_dict, rotation_dict)
+
+        return (location_dict, rotation_dict)
+
+    def publish(self, location_dict, rotation_dict, timestamp=None):
+        """Hands a received frame over to be applied and writes it to the
+        take. timestamp is the sender's time of a bundle."""
+        if self.take is not None:
+            self.take.add_frame(time.perf_counter() if timestamp is None else self.sender_time(timestamp), location_dict, rotation_dict, self.value_names)
+
+        if self.jitter is not None:
+            self.jitter.add(location_dict, rotation_dict, timestamp)
+        else:
+            self.frames.publish(location_dict, rotation_dict)
+
+    def receive(self, packets):
+        """Decodes the packets and publishes each complete frame to the
+        jitter buffer, or to the frame buffer of the network thread."""
+        for data in packets:
             decoded = OSC.decodeOSC(data)
-            ob_name = str(decoded[0], "utf-8")
-            
+
             try:
-                if (ob_name.startswith("@")):
-                    # Something to play with:
-                    # values that begin with a @ are python expressions,
-                    # and there is one parameter after the address in the OSC message
-                    # if you set something such as
-                    # bpy.data.objects"['Cube']".location.x= {V}
-                    # into a OSC path for, say, a face shape smile controller you can move an object by smiling
-                    to_evaluate = ob_name[1:]
-                    to_evaluate += str(decoded[2])
-                    try:
-                        print(exec(to_evaluate))
-                    except Exception as e:
-                        print(to_evaluate)
-                        print(str(e))
-                elif (ob_name.startswith("?")):
-                    # This one could be used for something such as mapping "thumbs up" gesture for rendering
-                    # Add the following path to a gesture controller OSC path
-                    # ?bpy.ops.render.render()
-                    to_evaluate = ob_name[1:]
-                    try:
-                        print(exec(to_evaluate))
-                    except Exception as e:
-                        print(to_evaluate)
-                        print(str(e))
-                elif len(decoded) == 3: #one value
-                    if ob_name == "/NI_mate_sync":
-                        if sync:
-                            self.next_sync = True
-                        else:
-                            sync = True
-                            apply_location_dict = self.location_dict.copy()
-                            apply_rotation_dict = self.rotation_dict.copy()
-                            self.location_dict = {}
-                            self.rotation_dict = {}
-                            self.next_location_dict = {}
-                            self.next_rotation_dict = {}
-                    else:
-                        if sync:
-                            self.next_location_dict[ob_name] = Vector([decoded[2], 0, 0])
-                        else:
-                            self.location_dict[ob_name] = Vector([decoded[2], 0, 0])
+                if decoded[0] == b"#bundle":
+                    location_dict, rotation_dict = self.parse_bundle(decoded)
 
-                elif len(decoded) == 5: #location
-                    if sync:
-                        self.next_location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
-                    else:
-                        self.location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
+                    self.synced = True
+                    self.publish(location_dict, rotation_dict, OSC.timetagToSeconds(decoded[1]))
 
-                elif len(decoded) == 6: #quaternion
-                    if sync:
-                        self.next_rotation_dict[ob_name] = Quaternion((-decoded[2], decoded[3], -decoded[5], decoded[4]))
-                    else:
-                        self.rotation_dict[ob_name] = Quaternion((-decoded[2], decoded[3], -decoded[5], decoded[4]))
-
-                elif len(decoded) == 9: #location & quaternion
-                    if sync:
-                        self.next_location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
-                        self.next_rotation_dict[ob_name] = Quaternion((-decoded[5], decoded[6], -decoded[8], decoded[7]))
-                    else:
-                        self.location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
-                        self.rotation_dict[ob_name] = Quaternion((-decoded[5], decoded[6], -decoded[8], decoded[7]))
+                elif self.parse_message(decoded, self.location_dict, self.rotation_dict):
+                    self.synced = True
+                    self.publish(self.location_dict, self.rotation_dict)
+                    self.location_dict = {}
+                    self.rotation_dict = {}
             except:
                 print("Delicode NI mate Tools error parsing OSC message: " + str(decoded))
                 pass
-            
+
+        # Without sync messages or bundles there are no frames, so the
+        # latest values are handed over as they arrive
+        if not self.synced and (len(self.location_dict) > 0 or len(self.rotation_dict) > 0):
+            self.publish(self.location_dict.copy(), self.rotation_dict.copy())
+
+    def receive_loop(self):
+        """Network thread: decodes everything NI mate sends as soon as it
+        arrives."""
+        while not self.stop_event.is_set():
             try:
-                trash = self.sock.recv(1024)
-            except:
+                readable, writable, errors = select.select([self.sock], [], [], 0.1)
+            except (OSError, ValueError):
                 break
 
-        if sync:            
-            for key, value in apply_location_dict.items():
-                set_location_func(objects, key, value, self.original_locations)
+            if len(readable) > 0:
+                self.receive(self.reader.drain())
+
+    def run_buffered(self, objects, set_location_func, set_rotation_func, packets=None):
+        frame = None
+
+        if self.thread is not None:
+            frame, expressions = self.frames.swap()
+
+            for to_evaluate in expressions:
+                self.evaluate(to_evaluate)
+        else:
+            self.receive(self.reader.drain() if packets is None else packets)
+
+        if self.jitter is not None:
+            frame = self.jitter.sample()
+
+        if frame is None:
+            return
+
+        timestamp = time.perf_counter() - (self.jitter.delay if self.jitter is not None else 0.0)
+
+        if take_recorder is not None:
+            take_recorder.begin_frame(timestamp)
+
+        apply_location_dict, apply_rotation_dict = frame
+
+        if self.predictor is not None:
+            # A frame held by the jitter buffer keeps its time
+            frame_time = self.jitter.sampled_time if self.jitter is not None else time.perf_counter()
+            apply_location_dict, apply_rotation_dict = self.predictor.predict(apply_location_dict, apply_rotation_dict, frame_time)
+
+        for key, value in apply_location_dict.items():
+            set_location_func(objects, key, value, self.original_locations)
+
+        for key, value in apply_rotation_dict.items():
+            set_rotation_func(objects, key, value, self.original_rotations)
+
+    def parse_pooled(self, decoded, pool):
+        """Same as parse_message, but stores the joint data in the reused
+        records of a JointPool instead of allocating new values. Returns
+        True if the message is the sync message ending a frame."""
+        address = decoded[0]
+        count = len(decoded)
+
+        if count not in (3, 5, 6, 9) or address.startswith(b"@") or address.startswith(b"?"):
+            return self.parse_message(decoded, {}, {})
+
+        if count == 3: #one value
+            if address == b"/NI_mate_sync":
+                return True
+
+            location = pool.location(address)
+            self.value_names.add(pool.records[address].name)
+            location.x = decoded[2]
+            location.y = 0.0
+            location.z = 0.0
+
+        if count == 5 or count == 9: #location
+            location = pool.location(address)
+            location.x = decoded[2]
+            location.y = -decoded[4]
+            location.z = decoded[3]
+
+        if count == 6: #quaternion
+            rotation = pool.rotation(address)
+            rotation.w = -decoded[2]
+            rotation.x = decoded[3]
+            rotation.y = -decoded[5]
+            rotation.z = decoded[4]
+
+        elif count == 9: #location & quaternion
+            rotation = pool.rotation(address)
+            rotation.w = -decoded[5]
+            rotation.x = decoded[6]
+            rotation.y = -decoded[8]
+            rotation.z = decoded[7]
+
+        return False
+
+    def apply_pool(self, pool, objects, set_location_func, set_rotation_func, timestamp):
+        location_dict = pool.location_dict
+        rotation_dict = pool.rotation_dict
+
+        if self.predictor is not None:
+            # The predictor keeps the values, so it gets copies of the records
+            location_dict, rotation_dict = self.predictor.predict(*pool.copy_dicts(), timestamp)
+
+        for key, value in location_dict.items():
+            set_location_func(objects, key, value, self.original_locations)
+
+        for key, value in rotation_dict.items():
+            set_rotation_func(objects, key, value, self.original_rotations)
+
+    def sender_time(self, sent):
+        """Converts a time in seconds on the sender's clock to the local
+        clock, the same way JitterBuffer.add does."""
+        offset = time.perf_counter() - sent
+        if self.clock_offset is None or offset < self.clock_offset or offset - self.clock_offset > 1.0:
+            self.clock_offset = offset
+        return sent + self.clock_offset
+
+    def run(self, objects, set_location_func, set_rotation_func, packets=None):
+        """Applies the received data. The packets are read from the socket
+        unless they are given."""
+        if self.thread is not None or self.jitter is not None:
+            return self.run_buffered(objects, set_location_func, set_rotation_func, packets)
+
+        # The frames are applied right away, so they're assembled into two
+        # pools of reused joint records: the frame being received and the
+        # newest complete one. A frame completed later in the same update
+        # replaces the older one, so only the newest is applied.
+        apply_pool = None
+        now = time.perf_counter()
+        timestamp = now
+        
+        if packets is None:
+            packets = self.reader.drain()
             
-            for key, value in apply_rotation_dict.items():
-                set_rotation_func(objects, key, value, self.original_rotations)
+        for data in packets:
+            decoded = OSC.decodeOSC(data)
             
-            self.location_dict = {}
-            self.rotation_dict = {}
-        else:
-            for key, value in self.location_dict.items():
-                set_location_func(objects, key, value, self.location_dict)
-                
-            for key, value in self.rotation_dict.items():
-                set_rotation_func(objects, key, value, self.rotation_dict)
+            try:
+                if decoded[0] == b"#bundle":
+                    # A bundle carries a whole skeleton frame, so it's used
+                    # as one frame without waiting for the sync message
+                    apply_pool = self.next_pool
+                    apply_pool.begin()
+
+                    for message in OSC.bundleMessages(decoded):
+                        self.parse_pooled(message, apply_pool)
+
+                    # Timed by the sender if the bundle has a timetag
+                    sent = OSC.timetagToSeconds(decoded[1])
+                    timestamp = self.sender_time(sent) if sent is not None else now
+                    self.synced = True
 
-    def __init__(self, UDP_PORT, QUIT_PORT):
+                    if self.take is not None:
+                        self.take.add_frame(timestamp, apply_pool.location_dict, apply_pool.rotation_dict, self.value_names)
+
+                elif self.parse_pooled(decoded, self.pool):
+                    # The messages after the sync message start the next frame
+                    self.pool, self.next_pool = self.next_pool, self.pool
+                    self.pool.begin()
+                    apply_pool = self.next_pool
+                    timestamp = now
+                    self.synced = True
+
+                    if self.take is not None:
+                        self.take.add_frame(timestamp, apply_pool.location_dict, apply_pool.rotation_dict, self.value_names)
+            except:
+                print("Delicode NI mate Tools error parsing OSC message: " + str(decoded))
+                pass
+
+        if take_recorder is not None:
+            take_recorder.begin_frame(timestamp)
+
+        # Without sync messages or bundles there are no frames, so the take
+        # gets everything received so far whenever something arrives
+        if self.take is not None and not self.synced and len(packets) > 0:
+            self.take.add_frame(timestamp, self.pool.location_dict, self.pool.rotation_dict, self.value_names)
+
+        if apply_pool is not None:
+            self.apply_pool(apply_pool, objects, set_location_func, set_rotation_func, timestamp)
+        elif not self.synced and len(packets) > 0:
+            # Without sync messages everything received so far is applied
+            self.apply_pool(self.pool, objects, set_location_func, set_rotation_func, timestamp)
+
+    def __init__(self, UDP_PORT, QUIT_PORT, MAX_PACKETS=1024, RECV_BUFFER_SIZE=0, THREADED=False, JITTER_DELAY=0.0, PREDICTION=0.0, PREFIX="", CAPTURE=None, TAKE=None):
         self.sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.setblocking(0)
+        self.reader = DatagramReader(self.sock, MAX_PACKETS, recv_buffer_size=RECV_BUFFER_SIZE)
+
+        if CAPTURE is not None:
+            self.reader.capture = CAPTURE
+            self.reader.capture_port = UDP_PORT
         ip = bpy.context.scene.delicode_ni_mate_ip
         self.sock.bind( (ip, UDP_PORT) )
 
         self.quit_port = QUIT_PORT
+        self.port = UDP_PORT
+        self.prefix = PREFIX
+        self.take = TAKE
 
         self.original_rotations = {}
         self.original_locations = {}
         
         self.location_dict = {}
         self.rotation_dict = {}
+
+        self.pool = JointPool(PREFIX)
+        self.next_pool = JointPool(PREFIX)
+        self.value_names = set()
+        self.clock_offset = None
+
+        if JITTER_DELAY > 0:
+            self.jitter = JitterBuffer(JITTER_DELAY, lambda a, b, t: a.lerp(b, t), lambda a, b, t: a.slerp(b, t))
+
+        if PREDICTION > 0:
+            # NI mate sends a zero w for joints it can't track
+            self.predictor = Predictor(PREDICTION, lambda a, b, t: a.lerp(b, t), extrapolate_quaternion, lambda q: q.w == 0.0)
+
+        if THREADED:
+            # The socket is owned by the network thread from here on
+            self.frames = FrameBuffer()
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self.receive_loop, name="NI mate receiver", daemon=True)
+            self.thread.start()
         
-        print("Delicode NI mate Tools started listening to OSC on port " + str(UDP_PORT))
+        print("Delicode NI mate Tools started listening to OSC on port " + str(UDP_PORT) + (" as " + PREFIX if PREFIX != "" else ""))
+
+    def stop(self):
+        """Stops the network thread. The thread keeps a reference to the
+        receiver, so this has to be called before the receiver is deleted."""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            print("Delicode NI mate Tools network thread stopped (%d frames, %d skipped)" % (self.frames.published, self.frames.skipped))
+            self.thread = None
 
     def __del__(self):
+        self.stop()
         self.sock.close()
-        print("Delicode NI mate Tools stopped listening to OSC")
+        print("Delicode NI mate Tools stopped listening to OSC on port " + str(self.port) + " (" + self.reader.stats() + ")")
+
+        if self.jitter is not None:
+            print("Delicode NI mate Tools jitter buffer: " + self.jitter.stats())
+
+        if self.predictor is not None:
+            print("Delicode NI mate Tools prediction: " + self.predictor.stats())
 
         if self.quit_port != None:
             if self.quit_port >= 0:
@@ -367,6 +1517,39 @@ class NImateReceiver():
                 for key, value in self.original_rotations.items():
                     bpy.data.objects[key].rotation_quaternion = value.copy()
 
+class NImateMultiReceiver():
+    """Receives from several sensors or NI mate instances, one port each,
+    with one receiver per port. The sockets are polled together with a
+    single select call per update and only the receivers with data waiting
+    are drained, the others just apply what they already have. Each
+    receiver namespaces its joint names with its own prefix, so the
+    skeletons from different sources don't overwrite each other."""
+
+    def __init__(self, receivers):
+        self.receivers = receivers
+        self.selector = selectors.DefaultSelector()
+
+        for receiver in receivers:
+            self.selector.register(receiver.sock, selectors.EVENT_READ, receiver)
+
+    def ready(self):
+        """Returns the receivers with data waiting in their sockets."""
+        return [key.data for key, events in self.selector.select(0)]
+
+    def run(self, objects, set_location_func, set_rotation_func):
+        ready = self.ready()
+
+        for receiver in self.receivers:
+            packets = None if receiver in ready else []
+            receiver.run(objects, set_location_func, set_rotation_func, packets)
+
+    def stop(self):
+        for receiver in self.receivers:
+            receiver.stop()
+
+    def __del__(self):
+        self.selector.close()
+
 class DelicodeNImate(bpy.types.Operator):
     bl_idname = "wm.delicode_ni_mate_start"
     bl_label = "Delicode NI mate Start"
@@ -376,13 +1559,22 @@ class DelicodeNImate(bpy.types.Operator):
     enabled = False
     receiver = None
     timer = None
+    driver = None
+    capture = None
+    take = None
     
     def modal(self, context, event):
         if event.type == 'ESC' or not __class__.enabled:
             return self.cancel(context)
         
         if event.type == 'TIMER':
-            self.receiver.run(bpy.data.objects, set_location, set_rotation)
+            object_cache.read_settings(context.scene)
+            if self.driver is not None:
+                self.receiver.run(bpy.data.objects, self.driver.set_location, self.driver.set_rotation)
+                self.driver.apply()
+            else:
+                self.receiver.run(bpy.data.objects, set_location, set_rotation)
+                create_pending_objects()
         
         return {'PASS_THROUGH'}     
 
@@ -390,6 +1582,7 @@ class DelicodeNImate(bpy.types.Operator):
         __class__.enabled = True
         global add_rotations
         global reset_locrot
+        global take_recorder
         add_rotations = bpy.context.scene.delicode_ni_mate_add_rotations
         reset_locrot = bpy.context.scene.delicode_ni_mate_reset
         lock_collection = bpy.context.scene.delicode_ni_mate_lock_collection
@@ -398,26 +1591,108 @@ class DelicodeNImate(bpy.types.Operator):
 
         if not lock_collection:
             if 'NIMate' in bpy.data.collections:
-                for ob in collection.objects:
-                    bpy.data.objects.remove(ob, do_unlink=True)
-                bpy.data.collections.remove(collection)
+                bpy.data.batch_remove(ids=list(collection.objects) + [collection])
   
         if 'NIMate' not in bpy.data.collections:
             bpy.context.view_layer.active_layer_collection = context.view_layer.layer_collection.children[0]
             base_collection = bpy.data.collections.new(name="NIMate")
             bpy.context.scene.collection.children.link(base_collection)
     
-        self.receiver = NImateReceiver(context.scene.delicode_ni_mate_port, None)
+        ports = [context.scene.delicode_ni_mate_port]
+
+        for port in context.scene.delicode_ni_mate_extra_ports.replace(",", " ").split():
+            try:
+                ports.append(int(port))
+            except ValueError:
+                print("Delicode NI mate Tools ignoring invalid port: " + port)
+
+        receivers = []
+        self.capture = None
+
+        if context.scene.delicode_ni_mate_capture != "":
+            try:
+                self.capture = PacketCapture(bpy.path.abspath(context.scene.delicode_ni_mate_capture))
+            except OSError as e:
+                print("Delicode NI mate Tools couldn't open the capture file: %s" % e)
+
+        self.take = None
+
+        if context.scene.delicode_ni_mate_take != "":
+            try:
+                # The receivers store the joints converted to Blender's axes
+                self.take = TakeWriter(bpy.path.abspath(context.scene.delicode_ni_mate_take), "Blender", lambda v: (v.x, v.z, -v.y), lambda q: (-q.w, q.x, q.z, -q.y))
+            except OSError as e:
+                print("Delicode NI mate Tools couldn't create the take: %s" % e)
+
+        for i, port in enumerate(ports):
+            # The joints from the additional ports are named sensor2_..., sensor3_...
+            prefix = "sensor" + str(i+1) + "_" if i > 0 else ""
+            receivers.append(NImateReceiver(port, None, context.scene.delicode_ni_mate_max_packets, 1024*context.scene.delicode_ni_mate_recv_buffer, context.scene.delicode_ni_mate_threaded, context.scene.delicode_ni_mate_jitter_delay/1000, context.scene.delicode_ni_mate_prediction/1000, prefix, self.capture, self.take))
+
+        if len(receivers) == 1:
+            self.receiver = receivers[0]
+        else:
+            self.receiver = NImateMultiReceiver(receivers)
         
+        # The cached objects are resolved again after objects are added,
+        # removed or renamed, and after undo replaces all of them
+        object_cache.clear()
+        bpy.app.handlers.depsgraph_update_post.append(object_cache_validate)
+        bpy.msgbus.subscribe_rna(key=(bpy.types.Object, "name"), owner=object_cache, args=(), notify=object_cache_renamed)
+        bpy.app.handlers.undo_post.append(object_cache_clear)
+        bpy.app.handlers.redo_post.append(object_cache_clear)
+
+        armature = context.scene.delicode_ni_mate_armature
+
+        if armature is not None and armature.type == 'ARMATURE':
+            self.driver = ArmatureDriver(armature)
+        else:
+            self.driver = None
+
+        if context.scene.delicode_ni_mate_record:
+            take_recorder = TakeRecorder(context.scene.render.fps / context.scene.render.fps_base, context.scene.frame_current)
+
+        bpy.ops.ed.undo_push(message="Start NI mate")
+
         context.window_manager.modal_handler_add(self)
         self.timer = context.window_manager.event_timer_add(1/context.scene.render.fps, window=bpy.context.window)
         return {'RUNNING_MODAL'}
     
     def cancel(self, context):
+        global take_recorder
         __class__.enabled = False
         context.window_manager.event_timer_remove(self.timer)
         
+        self.receiver.stop()
+
+        if take_recorder is not None:
+            take_recorder.bake(bpy.data.objects)
+            take_recorder = None
+
+        if self.driver is not None and reset_locrot:
+            self.driver.reset()
+        self.driver = None
+
         del self.receiver
+
+        if self.capture is not None:
+            self.capture.close()
+            print("Delicode NI mate Tools captured " + self.capture.stats())
+            self.capture = None
+
+        if self.take is not None:
+            self.take.close()
+            print("Delicode NI mate Tools streamed " + self.take.stats())
+            self.take = None
+
+        # The live updates don't push undo steps, the whole take becomes one
+        bpy.ops.ed.undo_push(message="NI mate take")
+
+        bpy.app.handlers.depsgraph_update_post.remove(object_cache_validate)
+        bpy.msgbus.clear_by_owner(object_cache)
+        bpy.app.handlers.undo_post.remove(object_cache_clear)
+        bpy.app.handlers.redo_post.remove(object_cache_clear)
+        object_cache.clear()
         
         return {'CANCELLED'}
     
@@ -426,6 +1701,31 @@ class DelicodeNImate(bpy.types.Operator):
         if cls.enabled:
             cls.enabled = False
             
+class DelicodeNImateBakeTake(bpy.types.Operator):
+    bl_idname = "wm.delicode_ni_mate_bake_take"
+    bl_label = "Bake NI mate Take"
+    bl_description = "Add the motion of a take streamed to disk as keyframes to the objects named after its joints, starting from the current frame"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    directory: bpy.props.StringProperty(subtype='DIR_PATH')
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        if numpy is None:
+            self.report({'ERROR'}, "Baking a take needs NumPy")
+            return {'CANCELLED'}
+
+        try:
+            bake_take(self.directory, bpy.data.objects, context.scene.render.fps / context.scene.render.fps_base, context.scene.frame_current)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, "Couldn't bake the take: %s" % e)
+            return {'CANCELLED'}
+
+        return {'FINISHED'}
+
 class DelicodeNImateStop(bpy.types.Operator):
     bl_idname = "wm.delicode_ni_mate_stop"
     bl_label = "Delicode NI mate Stop"
@@ -453,15 +1753,26 @@ class VIEW3D_PT_DelicodeNImatePanel(bpy.types.Panel):
         
         col.prop(scene, "delicode_ni_mate_ip", text="IP:")
         col.prop(scene, "delicode_ni_mate_port", text="Port:")
+        col.prop(scene, "delicode_ni_mate_extra_ports", text="Additional ports:")
         col.prop(scene, "delicode_ni_mate_create", text="Create:", expand=True);
+        col.prop(scene, "delicode_ni_mate_armature", text="Armature")
         col.prop(scene, "delicode_ni_mate_add_rotations", text="Add rotations")
         col.prop(scene, "delicode_ni_mate_reset", text="Reset on stop")
+        col.prop(scene, "delicode_ni_mate_record", text="Record take")
+        col.prop(scene, "delicode_ni_mate_take", text="Stream take to")
         col.prop(scene, "delicode_ni_mate_lock_collection", text="Lock collection")
+        col.prop(scene, "delicode_ni_mate_threaded", text="Receive in background")
+        col.prop(scene, "delicode_ni_mate_jitter_delay", text="Smoothing delay (ms)")
+        col.prop(scene, "delicode_ni_mate_prediction", text="Prediction (ms)")
+        col.prop(scene, "delicode_ni_mate_max_packets", text="Packets per update")
+        col.prop(scene, "delicode_ni_mate_recv_buffer", text="Socket buffer (KB)")
+        col.prop(scene, "delicode_ni_mate_capture", text="Capture OSC to")
         
         if(DelicodeNImate.enabled):
             layout.operator("wm.delicode_ni_mate_stop", text="Stop", icon='ARMATURE_DATA')
         else:
             layout.operator("wm.delicode_ni_mate_start", text="Start", icon='ARMATURE_DATA')
+            layout.operator("wm.delicode_ni_mate_bake_take", text="Bake take", icon='FILE_FOLDER')
             
 def init_properties():
     scene = bpy.types.Scene
@@ -479,6 +1790,50 @@ def init_properties():
         min = 0,
         max = 65535)
 
+    scene.delicode_ni_mate_extra_ports = bpy.props.StringProperty(
+        name="Additional ports",
+        description="Also receive OSC from other sensors or NI mate instances on these comma separated ports, the joints from them are prefixed with sensor2_, sensor3_ and so on",
+        default = "")
+
+    scene.delicode_ni_mate_threaded = bpy.props.BoolProperty(
+        name="Receive in background",
+        description="Receive and decode OSC data in a background thread and only apply the newest complete frame on each update",
+        default=False)
+
+    scene.delicode_ni_mate_jitter_delay = bpy.props.FloatProperty(
+        name="Smoothing delay",
+        description="Delay received frames by this many milliseconds and interpolate between them to hide network and timer jitter (0 applies the newest frame directly)",
+        default = 0.0,
+        min = 0.0,
+        max = 1000.0)
+
+    scene.delicode_ni_mate_prediction = bpy.props.FloatProperty(
+        name="Prediction",
+        description="Extrapolate joints this many milliseconds ahead from their recent velocity to hide latency (0 applies the received data as is)",
+        default = 0.0,
+        min = 0.0,
+        max = 500.0)
+
+    scene.delicode_ni_mate_max_packets = bpy.props.IntProperty(
+        name="Packets per update",
+        description="Maximum number of OSC packets read per update, the rest are read on the following updates",
+        default = 1024,
+        min = 1,
+        max = 65536)
+
+    scene.delicode_ni_mate_recv_buffer = bpy.props.IntProperty(
+        name="Socket buffer",
+        description="Size of the socket receive buffer in kilobytes, smaller buffers queue less stale data when Blender stalls (0 uses the system default)",
+        default = 0,
+        min = 0,
+        max = 65536)
+
+    scene.delicode_ni_mate_capture = bpy.props.StringProperty(
+        name="Capture OSC to",
+        description="Append everything received to this file with its arrival times, so that it can be replayed with Tools/osc_replay.py (empty doesn't capture)",
+        default = "",
+        subtype='FILE_PATH')
+
     scene.delicode_ni_mate_add_rotations = bpy.props.BoolProperty(
         name="Add Rotations",
         description="Add received rotation data to original rotations")
@@ -488,6 +1843,17 @@ def init_properties():
         description="Reset original object locations and rotations after receiving is stopped",
         default=True)
 
+    scene.delicode_ni_mate_record = bpy.props.BoolProperty(
+        name="Record take",
+        description="Record the received motion while running and add it as keyframes when stopped, instead of inserting keyframes on every update",
+        default=False)
+
+    scene.delicode_ni_mate_take = bpy.props.StringProperty(
+        name="Stream take to",
+        description="Stream the received motion to a take in this directory while running, so that it can be baked later in any of the NI mate plugins (empty doesn't stream)",
+        default = "",
+        subtype='DIR_PATH')
+
     scene.delicode_ni_mate_lock_collection = bpy.props.BoolProperty(
         name="Lock collection",
         description="Don't replace created objects if type is changed",
@@ -500,6 +1866,12 @@ def init_properties():
                 ('SPHERES', 'Spheres', 'Create spheres based on received data'),
                 ('CUBES', 'Cubes', 'Create cubes based on received data')])
     
+    scene.delicode_ni_mate_armature = bpy.props.PointerProperty(
+        name="Armature",
+        description="Drive the pose bones of this armature that are named after NI mate joints, instead of objects",
+        type=bpy.types.Object,
+        poll=lambda self, ob: ob.type == 'ARMATURE')
+
     scene.delicode_ni_mate_start_profile = bpy.props.StringProperty(
         name="NI mate profile",
         description="Path to the profile file used to start NI mate")
@@ -509,15 +1881,26 @@ def clear_properties():
 
     del scene.delicode_ni_mate_ip
     del scene.delicode_ni_mate_port
+    del scene.delicode_ni_mate_extra_ports
+    del scene.delicode_ni_mate_threaded
+    del scene.delicode_ni_mate_jitter_delay
+    del scene.delicode_ni_mate_prediction
+    del scene.delicode_ni_mate_max_packets
+    del scene.delicode_ni_mate_recv_buffer
+    del scene.delicode_ni_mate_capture
     del scene.delicode_ni_mate_add_rotations
     del scene.delicode_ni_mate_reset
+    del scene.delicode_ni_mate_record
+    del scene.delicode_ni_mate_take
     del scene.delicode_ni_mate_lock_collection
     del scene.delicode_ni_mate_create
+    del scene.delicode_ni_mate_armature
     del scene.delicode_ni_mate_start_profile
 
 classes = (
     DelicodeNImate,
     DelicodeNImateStop,
+    DelicodeNImateBakeTake,
     VIEW3D_PT_DelicodeNImatePanel
 )
 
@@ -34,7 +34,9 @@ from mathutils import Quaternion
 
 import math
 import struct
+import functools
 import socket
+import errno
 import subprocess, os
 import mmap
 import time
@@ -50,15 +52,82 @@ except ImportError:
 add_rotations = False
 reset_locrot = False
 
+class ObjectCache():
+    """Resolves joint names to objects once instead of looking them up for
+    every joint on every update. A cached object is checked to still have
+    the name when it's used, so renamed and removed objects are looked up
+    again. With cache_missing, names without an object are cached too and
+    validate() drops them when objects have been added or removed. That
+    misses an object renamed to a joint name, so it's only for the game
+    engine, where objects aren't renamed. clear() has to be called after
+    undo. The settings the set functions need are also read once per
+    update."""
+
+    def __init__(self, cache_missing=False):
+        self.handles = {}
+        self.cache_missing = cache_missing
+        self.object_count = -1
+        self.auto_key = False
+        self.create = 'NONE'
+
+    def get(self, objects, name):
+        """Returns the object with the name, or None if there isn't one."""
+        handle = self.handles.get(name, self)
+
+        if handle is not self and handle is not None:
+            # Removed objects raise ReferenceError, and game objects that
+            # have been ended SystemError
+            try:
+                if handle.name != name:
+                    handle = self
+            except (ReferenceError, SystemError):
+                handle = self
+
+        if handle is self:
+            handle = objects.get(name)
+            if handle is not None or self.cache_missing:
+                self.handles[name] = handle
+
+        return handle
+
+    def add(self, name, ob):
+        self.handles[name] = ob
+
+    def validate(self, objects):
+        """Drops the names without an object if objects have been added or
+        removed."""
+        if len(objects) != self.object_count:
+            for name in [name for name, handle in self.handles.items() if handle is None]:
+                del self.handles[name]
+            self.object_count = len(objects)
+
+    def clear(self):
+        self.handles.clear()
+        self.object_count = -1
+
+    def read_settings(self, scene):
+        self.auto_key = scene.tool_settings.use_keyframe_insert_auto
+        self.create = scene.delicode_ni_mate_create
+
+
+object_cache = ObjectCache()
+GE_object_cache = ObjectCache(cache_missing=True)
+
+def object_cache_clear(*args):
+    object_cache.clear()
+
+def get_GE_object(objects, ob_name):
+    return GE_object_cache.get(objects, ob_name)
+
 def set_GE_location(objects, ob_name, vec, originals):
-    ob = objects.get(ob_name)
+    ob = get_GE_object(objects, ob_name)
     
     if ob != None:
         ob.localPosition = 10*vec
         ob['time'] = -1
 
 def set_GE_rotation(objects, ob_name, quat, originals):
-    ob = objects.get(ob_name)
+    ob = get_GE_object(objects, ob_name)
     
     if ob != None:
         if ob_name not in originals.keys():
@@ -70,17 +139,19 @@ def set_GE_rotation(objects, ob_name, quat, originals):
             ob.localOrientation = quat
 
 def set_location(objects, ob_name, vec, originals):
-    if ob_name in objects.keys():
-        if ob_name not in originals.keys():
-            originals[ob_name] = objects[ob_name].location.copy()
+    ob = object_cache.get(objects, ob_name)
+
+    if ob is not None:
+        if ob_name not in originals:
+            originals[ob_name] = ob.location.copy()
 
-        objects[ob_name].location = 10*vec
+        ob.location = 10*vec
         
-        if(bpy.context.scene.tool_settings.use_keyframe_insert_auto):
-            objects[ob_name].keyframe_insert(data_path="location")
+        if(object_cache.auto_key):
+            ob.keyframe_insert(data_path="location")
 
-    elif bpy.context.scene.delicode_ni_mate_create != 'NONE':
-        ob_type = bpy.context.scene.delicode_ni_mate_create
+    elif object_cache.create != 'NONE':
+        ob_type = object_cache.create
         if(ob_type == 'EMPTIES'):
             bpy.ops.object.add()
             bpy.context.object.empty_draw_size = 0.2
@@ -93,23 +164,27 @@ def set_location(objects, ob_name, vec, originals):
         ob.name = ob_name
         ob.location = 10*vec
 
-        if(bpy.context.scene.tool_settings.use_keyframe_insert_auto):
-            objects[ob_name].keyframe_insert(data_path="location")
+        object_cache.add(ob_name, ob)
+
+        if(object_cache.auto_key):
+            ob.keyframe_insert(data_path="location")
 
 def set_rotation(objects, ob_name, quat, originals):
-    if ob_name in objects.keys():
-        objects[ob_name].rotation_mode = 'QUATERNION'
+    ob = object_cache.get(objects, ob_name)
 
-        if ob_name not in originals.keys():
-            originals[ob_name] = objects[ob_name].rotation_quaternion.copy()
+    if ob is not None:
+        ob.rotation_mode = 'QUATERNION'
+
+        if ob_name not in originals:
+            originals[ob_name] = ob.rotation_quaternion.copy()
 
         if add_rotations:
-            objects[ob_name].rotation_quaternion = quat * originals[ob_name]
+            ob.rotation_quaternion = quat * originals[ob_name]
         else:
-            objects[ob_name].rotation_quaternion = quat
+            ob.rotation_quaternion = quat
         
-        if(bpy.context.scene.tool_settings.use_keyframe_insert_auto):
-            objects[ob_name].keyframe_insert(data_path="rotation_quaternion")
+        if(object_cache.auto_key):
+            ob.keyframe_insert(data_path="rotation_quaternion")
 
 def rotation_from_matrix(m00, m01, m02, m10, m11, m12, m20, m21, m22):
     mat = Matrix()
@@ -126,96 +201,210 @@ def rotation_from_matrix(m00, m01, m02, m10, m11, m12, m20, m21, m22):
     return mat.to_quaternion()
             
 class OSC():
-    def readByte(data):
-        length   = data.find(b'\x00')
-        nextData = int(math.ceil((length+1) / 4.0) * 4)
-        return (data[0:length], data[nextData:])
+    # The readers take a memoryview of the whole datagram and an offset into
+    # it, and return the decoded value together with the offset of the next
+    # field, so decoding a message never copies the rest of the datagram.
+    def readByte(data, offset):
+        # OSC strings are padded with nulls to a multiple of four bytes, so
+        # the last byte of the word containing the terminator is always null.
+        end = offset + 3
+        while data[end] != 0:
+            end += 4
+        length = end - 3
+        while data[length] != 0:
+            length += 1
+        return (data[offset:length].tobytes(), end + 1)
 
     
-    def readString(data):
-        length   = str(data).find("\0")
-        nextData = int(math.ceil((length+1) / 4.0) * 4)
-        return (data[0:length], data[nextData:])
+    def readString(data, offset):
+        string, nextData = OSC.readByte(data, offset)
+        return (string.decode("utf-8"), nextData)
     
     
-    def readBlob(data):
-        length   = struct.unpack(">i", data[0:4])[0]
-        nextData = int(math.ceil((length) / 4.0) * 4) + 4
-        return (data[4:length+4], data[nextData:])
+    def readBlob(data, offset):
+        length   = struct.unpack_from(">i", data, offset)[0]
+        nextData = offset + int(math.ceil((length) / 4.0) * 4) + 4
+        return (data[offset+4:offset+length+4].tobytes(), nextData)
     
     
-    def readInt(data):
-        if(len(data)<4):
-            print("Error: too few bytes for int", data, len(data))
-            rest = data
-            integer = 0
-        else:
-            integer = struct.unpack(">i", data[0:4])[0]
-            rest    = data[4:]
-    
-        return (integer, rest)
+    def readInt(data, offset):
+        """Raises struct.error if there are fewer than 4 bytes left."""
+        return (struct.unpack_from(">i", data, offset)[0], offset+4)
     
     
-    def readLong(data):
+    def readLong(data, offset):
         """Tries to interpret the next 8 bytes of the data
         as a 64-bit signed integer."""
-        high, low = struct.unpack(">ll", data[0:8])
-        big = (long(high) << 32) + low
-        rest = data[8:]
-        return (big, rest)
+        big = struct.unpack_from(">q", data, offset)[0]
+        return (big, offset+8)
+    
     
+    def readTimetag(data, offset):
+        """Reads a 64-bit NTP timetag, seconds since 1900 in the high 32 bits
+        and the fraction of a second in the low 32 bits."""
+        timetag = struct.unpack_from(">Q", data, offset)[0]
+        return (timetag, offset+8)
     
-    def readDouble(data):
+    def timetagToSeconds(timetag):
+        """Converts an NTP timetag to seconds, or None for the special
+        timetag 1 meaning "immediately"."""
+        if timetag == 1:
+            return None
+        return (timetag >> 32) + (timetag & 0xffffffff) / 4294967296.0
+    
+    def readDouble(data, offset):
         """Tries to interpret the next 8 bytes of the data
         as a 64-bit double float."""
-        floater = struct.unpack(">d", data[0:8])
-        big = float(floater[0])
-        rest = data[8:]
-        return (big, rest)
+        big = struct.unpack_from(">d", data, offset)[0]
+        return (big, offset+8)
     
     
     
-    def readFloat(data):
-        if(len(data)<4):
-            print("Error: too few bytes for float", data, len(data))
-            rest = data
-            float = 0
-        else:
-            float = struct.unpack(">f", data[0:4])[0]
-            rest  = data[4:]
+    def readFloat(data, offset):
+        """Raises struct.error if there are fewer than 4 bytes left."""
+        return (struct.unpack_from(">f", data, offset)[0], offset+4)
     
-        return (float, rest)
-    
-    def decodeOSC(data):
+    @functools.lru_cache(maxsize=32)
+    def compileTypetags(typetags):
+        """Returns a struct.Struct that unpacks all the arguments described
+        by the typetags in one call, or None if the arguments include
+        variable length strings or blobs. NI mate only sends a handful of
+        different typetags, so the compiled structs are cached."""
+        tags = typetags[1:].decode("utf-8")
+        if any(tag not in "ifd" for tag in tags):
+            return None
+        return struct.Struct(">" + tags)
+
+    def decodeArguments(data, offset, typetags, decoded):
         table = { "i" : OSC.readInt, "f" : OSC.readFloat, "s" : OSC.readString, "b" : OSC.readBlob, "d" : OSC.readDouble }
+        for tag in typetags[1:]:
+            value, offset = table[chr(tag)](data, offset)
+            decoded.append(value)
+        return offset
+
+    def bundleMessages(decoded):
+        """Yields the messages of a decoded bundle in the order they were
+        sent, including the messages of nested bundles."""
+        for element in decoded[2:]:
+            if len(element) == 0:
+                continue
+            if element[0] == b"#bundle":
+                yield from OSC.bundleMessages(element)
+            else:
+                yield element
+
+    def decodeOSC(data):
+        data = memoryview(data)
         decoded = []
-        address,  rest = OSC.readByte(data)
         typetags = ""
-        
-        if address == "#bundle":
-            time, rest = readLong(rest)
-            decoded.append(address)
-            decoded.append(time)
-            while len(rest)>0:
-                length, rest = OSC.readInt(rest)
-                decoded.append(OSC.decodeOSC(rest[:length]))
-                rest = rest[length:]
-    
-        elif len(rest) > 0:
-            typetags, rest = OSC.readByte(rest)
-            decoded.append(address)
-            decoded.append(typetags)
+
+        try:
+            address, offset = OSC.readByte(data, 0)
             
-            if len(typetags) > 0:        
-                if typetags[0] == ord(','):
-                    for tag in typetags[1:]:
-                        value, rest = table[chr(tag)](rest)
-                        decoded.append(value)
-                else:
-                    print("Oops, typetag lacks the magic")
+            if address == b"#bundle":
+                timetag, offset = OSC.readTimetag(data, offset)
+                decoded.append(address)
+                decoded.append(timetag)
+                while offset < len(data):
+                    length, offset = OSC.readInt(data, offset)
+                    if length <= 0 or length % 4 != 0 or offset+length > len(data):
+                        print("Error: invalid OSC bundle element size", length)
+                        break
+                    decoded.append(OSC.decodeOSC(data[offset:offset+length]))
+                    offset += length
+        
+            elif offset < len(data):
+                typetags, offset = OSC.readByte(data, offset)
+                decoded.append(address)
+                decoded.append(typetags)
+                
+                if len(typetags) > 0:
+                    if typetags[0] == ord(','):
+                        compiled = OSC.compileTypetags(typetags)
+                        if compiled is not None and len(data)-offset >= compiled.size:
+                            decoded.extend(compiled.unpack_from(data, offset))
+                        else:
+                            OSC.decodeArguments(data, offset, typetags, decoded)
+                    else:
+                        print("Oops, typetag lacks the magic")
+        except (IndexError, struct.error):
+            print("Error: truncated OSC message", data.tobytes())
     
         return decoded
 
+class DatagramReader():
+    """Drains a non-blocking UDP socket into one preallocated buffer with
+    recv_into, so receiving doesn't allocate a new bytes object for every
+    datagram. At most max_packets datagrams are read per drain to bound the
+    time spent on a tick, the rest stay queued in the socket for the next
+    tick. Datagrams larger than max_packet_size are counted as truncated and
+    dropped instead of being decoded partially."""
+
+    # The errno of a datagram too large for the read, POSIX and Windows
+    MSGSIZE_ERRORS = (errno.EMSGSIZE, getattr(errno, "WSAEMSGSIZE", errno.EMSGSIZE))
+
+    def __init__(self, sock, max_packets=1024, max_packet_size=16384, recv_buffer_size=0):
+        self.sock = sock
+        self.max_packets = max_packets
+        self.max_packet_size = max_packet_size
+
+        # A lower SO_RCVBUF bounds how much stale data the socket can queue
+        # while the host application is stalled
+        if recv_buffer_size > 0:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer_size)
+        self.recv_buffer_size = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+        # Reading one byte more than the largest accepted datagram tells
+        # truncated datagrams apart from ones that fit exactly
+        self.buffer = bytearray(max(1024*1024, 4*(max_packet_size+1)))
+        self.view = memoryview(self.buffer)
+
+        self.packets = 0
+        self.truncated = 0
+        self.overflows = 0
+
+    def drain(self):
+        """Returns memoryviews of the datagrams waiting in the socket. The
+        views point to the shared buffer and are only valid until the next
+        call."""
+        packets = []
+        offset = 0
+        read_size = self.max_packet_size + 1
+
+        while len(packets) < self.max_packets and offset + read_size <= len(self.buffer):
+            try:
+                size = self.sock.recv_into(self.view[offset:offset+read_size], read_size)
+            except BlockingIOError:
+                # Nothing left to read in the non-blocking socket
+                self.packets += len(packets)
+                return packets
+            except ConnectionResetError:
+                # Windows reports an ICMP port unreachable as a reset on the
+                # next receive, the socket itself still works
+                continue
+            except OSError as e:
+                # Windows fails the receive of a datagram larger than the
+                # read size instead of truncating it
+                if e.errno in self.MSGSIZE_ERRORS:
+                    self.truncated += 1
+                    continue
+                raise
+
+            if size > self.max_packet_size:
+                self.truncated += 1
+                continue
+
+            packets.append(self.view[offset:offset+size])
+            offset += size
+
+        # The budget ran out before the socket was empty
+        self.overflows += 1
+        self.packets += len(packets)
+        return packets
+
+    def stats(self):
+        return "%d packets, %d truncated, %d overflows, %d byte socket buffer" % (self.packets, self.truncated, self.overflows, self.recv_buffer_size)
+
  
 class NImateReceiver():
     original_rotations = {}
@@ -226,112 +415,90 @@ class NImateReceiver():
     
     location_dict = {}
     rotation_dict = {}
-    
-    next_location_dict = {}
-    next_rotation_dict = {}
-    next_sync = False
+
+    def parse_message(self, decoded, location_dict, rotation_dict):
+        """Stores the joint data of a decoded OSC message in the dicts.
+        Returns True if the message is the sync message ending a frame."""
+        ob_name = str(decoded[0], "utf-8")
+
+        if (ob_name.startswith("@")):
+            # Something to play with:
+            # values that begin with a @ are python expressions,
+            # and there is one parameter after the address in the OSC message
+            # if you set something such as
+            # bpy.data.objects"['Cube']".location.x= {V}
+            # into a OSC path for, say, a face shape smile controller you can move an object by smiling
+            to_evaluate = ob_name[1:]
+            to_evaluate += str(decoded[2])
+            try:
+                print(exec(to_evaluate))
+            except Exception as e:
+                print(to_evaluate)
+                print(str(e))
+        elif (ob_name.startswith("?")):
+            # This one could be used for something such as mapping "thumbs up" gesture for rendering
+            # Add the following path to a gesture controller OSC path
+            # ?bpy.ops.render.render()
+            to_evaluate = ob_name[1:]
+            try:
+                print(exec(to_evaluate))
+            except Exception as e:
+                print(to_evaluate)
+                print(str(e))
+        elif len(decoded) == 3: #one value
+            if ob_name == "NI_mate_sync":
+                return True
+
+            location_dict[ob_name] = Vector([decoded[2], 0, 0])
+
+        elif len(decoded) == 5: #location
+            location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
+
+        elif len(decoded) == 6: #quaternion
+            rotation_dict[ob_name] = Quaternion((-decoded[2], decoded[3], -decoded[5], decoded[4]))
+
+        elif len(decoded) == 9: #location & quaternion
+            location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
+            rotation_dict[ob_name] = Quaternion((-decoded[5], decoded[6], -decoded[8], decoded[7]))
+
+        return False
 
     def run(self, objects, set_location_func, set_rotation_func):
         
         apply_location_dict = {}
         apply_rotation_dict = {}
         
-        receive = True
-        
         sync = False
         
-        try:
-            data = self.sock.recv( 1024 )
-        except:
-            data = None
-
-            if self.next_sync:            
-                apply_location_dict = self.next_location_dict.copy()
-                apply_rotation_dict = self.next_rotation_dict.copy()
-                self.next_location_dict = {}
-                self.next_rotation_dict = {}
-                self.next_sync = False
-                sync = True
-            
-            receive = False
-            
-        trash = data
-        while(receive):
-            data = trash
-            
+        packets = self.reader.drain()
+
+        # A frame completed later in the same update replaces the older
+        # one, so only the newest is applied
+        for data in packets:
             decoded = OSC.decodeOSC(data)
-            ob_name = str(decoded[0], "utf-8")
             
             try:
-                if (ob_name.startswith("@")):
-                    # Something to play with:
-                    # values that begin with a @ are python expressions,
-                    # and there is one parameter after the address in the OSC message
-                    # if you set something such as
-                    # bpy.data.objects"['Cube']".location.x= {V}
-                    # into a OSC path for, say, a face shape smile controller you can move an object by smiling
-                    to_evaluate = ob_name[1:]
-                    to_evaluate += str(decoded[2])
-                    try:
-                        print(exec(to_evaluate))
-                    except Exception as e:
-                        print(to_evaluate)
-                        print(str(e))
-                elif (ob_name.startswith("?")):
-                    # This one could be used for something such as mapping "thumbs up" gesture for rendering
-                    # Add the following path to a gesture controller OSC path
-                    # ?bpy.ops.render.render()
-                    to_evaluate = ob_name[1:]
-                    try:
-                        print(exec(to_evaluate))
-                    except Exception as e:
-                        print(to_evaluate)
-                        print(str(e))
-                elif len(decoded) == 3: #one value
-                    if ob_name == "NI_mate_sync":
-                        if sync:
-                            self.next_sync = True
-                        else:
-                            sync = True
-                            apply_location_dict = self.location_dict.copy()
-                            apply_rotation_dict = self.rotation_dict.copy()
-                            self.location_dict = {}
-                            self.rotation_dict = {}
-                            self.next_location_dict = {}
-                            self.next_rotation_dict = {}
-                    else:
-                        if sync:
-                            self.next_location_dict[ob_name] = Vector([decoded[2], 0, 0])
-                        else:
-                            self.location_dict[ob_name] = Vector([decoded[2], 0, 0])
-
-                elif len(decoded) == 5: #location
-                    if sync:
-                        self.next_location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
-                    else:
-                        self.location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
-
-                elif len(decoded) == 6: #quaternion
-                    if sync:
-                        self.next_rotation_dict[ob_name] = Quaternion((-decoded[2], decoded[3], -decoded[5], decoded[4]))
-                    else:
-                        self.rotation_dict[ob_name] = Quaternion((-decoded[2], decoded[3], -decoded[5], decoded[4]))
-
-                elif len(decoded) == 9: #location & quaternion
-                    if sync:
-                        self.next_location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
-                        self.next_rotation_dict[ob_name] = Quaternion((-decoded[5], decoded[6], -decoded[8], decoded[7]))
-                    else:
-                        self.location_dict[ob_name] = Vector([decoded[2], -decoded[4], decoded[3]])
-                        self.rotation_dict[ob_name] = Quaternion((-decoded[5], decoded[6], -decoded[8], decoded[7]))
+                if decoded[0] == b"#bundle":
+                    # A bundle carries a whole skeleton frame, so it's used
+                    # as one frame without waiting for the sync message
+                    apply_location_dict = {}
+                    apply_rotation_dict = {}
+
+                    for message in OSC.bundleMessages(decoded):
+                        self.parse_message(message, apply_location_dict, apply_rotation_dict)
+
+                    sync = True
+
+                elif self.parse_message(decoded, self.location_dict, self.rotation_dict):
+                    # The messages after the sync message start the next frame
+                    sync = True
+                    apply_location_dict = self.location_dict
+                    apply_rotation_dict = self.rotation_dict
+                    self.location_dict = {}
+                    self.rotation_dict = {}
             except:
                 print("Delicode NI mate Tools error parsing OSC message: " + str(decoded))
                 pass
-            
-            try:
-                trash = self.sock.recv(1024)
-            except:
-                break
 
         if sync:            
             for key, value in apply_location_dict.items():
@@ -339,9 +506,6 @@ class NImateReceiver():
             
             for key, value in apply_rotation_dict.items():
                 set_rotation_func(objects, key, value, self.original_rotations)
-            
-            self.location_dict = {}
-            self.rotation_dict = {}
         else:
             for key, value in self.location_dict.items():
                 set_location_func(objects, key, value, self.location_dict)
@@ -349,10 +513,11 @@ class NImateReceiver():
             for key, value in self.rotation_dict.items():
                 set_rotation_func(objects, key, value, self.rotation_dict)
 
-    def __init__(self, UDP_PORT, QUIT_PORT):
+    def __init__(self, UDP_PORT, QUIT_PORT, MAX_PACKETS=1024, RECV_BUFFER_SIZE=0):
         self.sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.setblocking(0)
+        self.reader = DatagramReader(self.sock, MAX_PACKETS, recv_buffer_size=RECV_BUFFER_SIZE)
         self.sock.bind( ("127.0.0.1", UDP_PORT) )
 
         self.quit_port = QUIT_PORT
@@ -367,7 +532,7 @@ class NImateReceiver():
 
     def __del__(self):
         self.sock.close()
-        print("Delicode NI mate Tools stopped listening to OSC")
+        print("Delicode NI mate Tools stopped listening to OSC (" + self.reader.stats() + ")")
 
         if self.quit_port != None:
             if self.quit_port >= 0:
@@ -660,6 +825,7 @@ if not GE:
                 return self.cancel(context)
             
             if event.type == 'TIMER':
+                object_cache.read_settings(context.scene)
                 self.receiver.run(bpy.data.objects, set_location, set_rotation)
             
             return {'PASS_THROUGH'}     
@@ -672,6 +838,12 @@ if not GE:
             reset_locrot = bpy.context.scene.delicode_ni_mate_reset
             self.receiver = NImateReceiver(context.scene.delicode_ni_mate_port, None)
             
+            # The cached objects are resolved again after undo replaces all
+            # of them
+            object_cache.clear()
+            bpy.app.handlers.undo_post.append(object_cache_clear)
+            bpy.app.handlers.redo_post.append(object_cache_clear)
+            
             context.window_manager.modal_handler_add(self)
             self.timer = context.window_manager.event_timer_add(1/context.scene.render.fps, context.window)
             return {'RUNNING_MODAL'}
@@ -682,6 +854,10 @@ if not GE:
             
             del self.receiver
             
+            bpy.app.handlers.undo_post.remove(object_cache_clear)
+            bpy.app.handlers.redo_post.remove(object_cache_clear)
+            object_cache.clear()
+            
             return {'CANCELLED'}
         
         @classmethod
@@ -913,7 +1089,9 @@ def updateGE(controller):
     if hasattr(bge.logic, 'DelicodeNImate') == False:
         setupGE(controller.owner)
 
-    bge.logic.DelicodeNImate.run(bge.logic.getCurrentScene().objects, set_GE_location, set_GE_rotation)
+    objects = bge.logic.getCurrentScene().objects
+    GE_object_cache.validate(objects)
+    bge.logic.DelicodeNImate.run(objects, set_GE_location, set_GE_rotation)
 
 def setupFeed(own):
     import bge
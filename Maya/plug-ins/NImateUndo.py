@@ -0,0 +1,60 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Delicode NI mate Maya Plugin v2.0
+# http://www.ni-mate.com
+
+# The NImateUndo command puts the changes the NI mate receiver made
+# through the API on the undo queue. The receiver applies its
+# MDagModifiers and MAnimCurveChanges itself and then runs the command,
+# which takes them from the receiver as one undo step.
+
+import maya.OpenMayaMPx as ompx
+
+COMMAND_NAME = "NImateUndo"
+
+class NImateUndoCommand(ompx.MPxCommand):
+    def __init__(self):
+        ompx.MPxCommand.__init__(self)
+        self.changes = []
+
+    def isUndoable(self):
+        return True
+
+    def doIt(self, args):
+        import NImateReceiverForMaya
+        self.changes = NImateReceiverForMaya.take_undo()
+
+    def undoIt(self):
+        for undo, redo in reversed(self.changes):
+            undo()
+
+    def redoIt(self):
+        for undo, redo in self.changes:
+            redo()
+
+def creator():
+    return ompx.asMPxPtr(NImateUndoCommand())
+
+def initializePlugin(mobject):
+    plugin = ompx.MFnPlugin(mobject, "Delicode", "2.0")
+    plugin.registerCommand(COMMAND_NAME, creator)
+
+def uninitializePlugin(mobject):
+    plugin = ompx.MFnPlugin(mobject)
+    plugin.deregisterCommand(COMMAND_NAME)
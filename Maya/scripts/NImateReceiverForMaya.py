@@ -21,9 +21,11 @@
 
 import maya.cmds as cmds
 import maya.OpenMaya as om
+import maya.OpenMayaAnim as oma
 
 from functools import partial
 import socket
+import errno
 import sys
 import os
 import time
@@ -31,236 +33,1370 @@ import threading
 import math
 import maya.utils as utils
 import struct
+import json
+import functools
+import collections
+import selectors
+import array
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 preferences = None
 
 class OSC():
+    # The readers take a memoryview of the whole datagram and an offset into
+    # it, and return the decoded value together with the offset of the next
+    # field, so decoding a message never copies the rest of the datagram.
     @staticmethod
-    def readByte(data):
-        length   = data.find(b'\x00')
-        nextData = int(math.ceil((length+1) / 4.0) * 4)
-        return (data[0:length], data[nextData:])
+    def readByte(data, offset):
+        # OSC strings are padded with nulls to a multiple of four bytes, so
+        # the last byte of the word containing the terminator is always null.
+        end = offset + 3
+        while data[end] != 0:
+            end += 4
+        length = end - 3
+        while data[length] != 0:
+            length += 1
+        return (data[offset:length].tobytes().decode("utf-8"), end + 1)
 
     @staticmethod
-    def readString(data):
-        length   = str(data).find("\0")
-        nextData = int(math.ceil((length+1) / 4.0) * 4)
-        return (data[0:length], data[nextData:])
+    def readString(data, offset):
+        return OSC.readByte(data, offset)
     
     @staticmethod
-    def readBlob(data):
-        length   = struct.unpack(">i", data[0:4])[0]
-        nextData = int(math.ceil((length) / 4.0) * 4) + 4
-        return (data[4:length+4], data[nextData:])
+    def readBlob(data, offset):
+        length   = struct.unpack_from(">i", data, offset)[0]
+        nextData = offset + int(math.ceil((length) / 4.0) * 4) + 4
+        return (data[offset+4:offset+length+4].tobytes(), nextData)
     
     @staticmethod
-    def readInt(data):
-        if(len(data)<4):
-            print("Error: too few bytes for int", data, len(data))
-            rest = data
-            integer = 0
-        else:
-            integer = struct.unpack(">i", data[0:4])[0]
-            rest    = data[4:]
-    
-        return (integer, rest)
+    def readInt(data, offset):
+        """Raises struct.error if there are fewer than 4 bytes left."""
+        return (struct.unpack_from(">i", data, offset)[0], offset+4)
     
     @staticmethod
-    def readLong(data):
+    def readLong(data, offset):
         """Tries to interpret the next 8 bytes of the data
         as a 64-bit signed integer."""
-        high, low = struct.unpack(">ll", data[0:8])
-        big = (long(high) << 32) + low
-        rest = data[8:]
-        return (big, rest)
+        big = struct.unpack_from(">q", data, offset)[0]
+        return (big, offset+8)
+    
+    @staticmethod
+    def readTimetag(data, offset):
+        """Reads a 64-bit NTP timetag, seconds since 1900 in the high 32 bits
+        and the fraction of a second in the low 32 bits."""
+        timetag = struct.unpack_from(">Q", data, offset)[0]
+        return (timetag, offset+8)
     
     @staticmethod
-    def readDouble(data):
+    def timetagToSeconds(timetag):
+        """Converts an NTP timetag to seconds, or None for the special
+        timetag 1 meaning "immediately"."""
+        if timetag == 1:
+            return None
+        return (timetag >> 32) + (timetag & 0xffffffff) / 4294967296.0
+    
+    @staticmethod
+    def readDouble(data, offset):
         """Tries to interpret the next 8 bytes of the data
         as a 64-bit double float."""
-        floater = struct.unpack(">d", data[0:8])
-        big = float(floater[0])
-        rest = data[8:]
-        return (big, rest)
+        big = struct.unpack_from(">d", data, offset)[0]
+        return (big, offset+8)
     
     
     @staticmethod
-    def readFloat(data):
-        if(len(data)<4):
-            print("Error: too few bytes for float", data, len(data))
-            rest = data
-            float = 0
-        else:
-            float = struct.unpack(">f", data[0:4])[0]
-            rest  = data[4:]
-    
-        return (float, rest)
+    def readFloat(data, offset):
+        """Raises struct.error if there are fewer than 4 bytes left."""
+        return (struct.unpack_from(">f", data, offset)[0], offset+4)
     
     @staticmethod
-    def decodeOSC(data):
+    @functools.lru_cache(maxsize=32)
+    def compileTypetags(typetags):
+        """Returns a struct.Struct that unpacks all the arguments described
+        by the typetags in one call, or None if the arguments include
+        variable length strings or blobs. NI mate only sends a handful of
+        different typetags, so the compiled structs are cached."""
+        tags = typetags[1:]
+        if any(tag not in "ifd" for tag in tags):
+            return None
+        return struct.Struct(">" + tags)
+
+    @staticmethod
+    def decodeArguments(data, offset, typetags, decoded):
         table = { "i" : OSC.readInt, "f" : OSC.readFloat, "s" : OSC.readString, "b" : OSC.readBlob, "d" : OSC.readDouble }
+        for tag in typetags[1:]:
+            value, offset = table[tag](data, offset)
+            decoded.append(value)
+        return offset
+
+    @staticmethod
+    def bundleMessages(decoded):
+        """Yields the messages of a decoded bundle in the order they were
+        sent, including the messages of nested bundles."""
+        for element in decoded[2:]:
+            if len(element) == 0:
+                continue
+            if element[0] == "#bundle":
+                yield from OSC.bundleMessages(element)
+            else:
+                yield element
+
+    @staticmethod
+    def decodeOSC(data):
+        data = memoryview(data)
         decoded = []
-        address,  rest = OSC.readByte(data)
         typetags = ""
-        
-        if address == "#bundle":
-            time, rest = readLong(rest)
-            decoded.append(address)
-            decoded.append(time)
-            while len(rest)>0:
-                length, rest = OSC.readInt(rest)
-                decoded.append(OSC.decodeOSC(rest[:length]))
-                rest = rest[length:]
-    
-        elif len(rest) > 0:
-            typetags, rest = OSC.readByte(rest)
-            decoded.append(address)
-            decoded.append(typetags)
+
+        try:
+            address, offset = OSC.readByte(data, 0)
             
-            if len(typetags) > 0:
-                if typetags[0] == ',':
-                    for tag in typetags[1:]:
-                        value, rest = table[tag](rest)
-                        decoded.append(value)
-                else:
-                    print("Oops, typetag lacks the magic")
+            if address == "#bundle":
+                timetag, offset = OSC.readTimetag(data, offset)
+                decoded.append(address)
+                decoded.append(timetag)
+                while offset < len(data):
+                    length, offset = OSC.readInt(data, offset)
+                    if length <= 0 or length % 4 != 0 or offset+length > len(data):
+                        print("Error: invalid OSC bundle element size", length)
+                        break
+                    decoded.append(OSC.decodeOSC(data[offset:offset+length]))
+                    offset += length
+        
+            elif offset < len(data):
+                typetags, offset = OSC.readByte(data, offset)
+                decoded.append(address)
+                decoded.append(typetags)
+                
+                if len(typetags) > 0:
+                    if typetags[0] == ',':
+                        compiled = OSC.compileTypetags(typetags)
+                        if compiled is not None and len(data)-offset >= compiled.size:
+                            decoded.extend(compiled.unpack_from(data, offset))
+                        else:
+                            OSC.decodeArguments(data, offset, typetags, decoded)
+                    else:
+                        print("Oops, typetag lacks the magic")
+        except (IndexError, struct.error):
+            print("Error: truncated OSC message", data.tobytes())
     
         return decoded
 
-class TimerObj(threading.Thread):
-    def __init__(self, cmd):
+class DatagramReader():
+    """Drains a non-blocking UDP socket into one preallocated buffer with
+    recv_into, so receiving doesn't allocate a new bytes object for every
+    datagram. At most max_packets datagrams are read per drain to bound the
+    time spent on a tick, the rest stay queued in the socket for the next
+    tick. Datagrams larger than max_packet_size are counted as truncated and
+    dropped instead of being decoded partially. With a capture set, every
+    accepted datagram is also written to it as it's read."""
+
+    # The errno of a datagram too large for the read, POSIX and Windows
+    MSGSIZE_ERRORS = (errno.EMSGSIZE, getattr(errno, "WSAEMSGSIZE", errno.EMSGSIZE))
+
+    def __init__(self, sock, max_packets=1024, max_packet_size=16384, recv_buffer_size=0):
+        self.sock = sock
+        self.max_packets = max_packets
+        self.max_packet_size = max_packet_size
+
+        # A lower SO_RCVBUF bounds how much stale data the socket can queue
+        # while the host application is stalled
+        if recv_buffer_size > 0:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer_size)
+        self.recv_buffer_size = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+        # Reading one byte more than the largest accepted datagram tells
+        # truncated datagrams apart from ones that fit exactly
+        self.buffer = bytearray(max(1024*1024, 4*(max_packet_size+1)))
+        self.view = memoryview(self.buffer)
+
+        self.packets = 0
+        self.truncated = 0
+        self.overflows = 0
+
+        self.capture = None
+        self.capture_port = 0
+
+    def drain(self):
+        """Returns memoryviews of the datagrams waiting in the socket. The
+        views point to the shared buffer and are only valid until the next
+        call."""
+        packets = []
+        offset = 0
+        read_size = self.max_packet_size + 1
+
+        while len(packets) < self.max_packets and offset + read_size <= len(self.buffer):
+            try:
+                size = self.sock.recv_into(self.view[offset:offset+read_size], read_size)
+            except BlockingIOError:
+                # Nothing left to read in the non-blocking socket
+                self.packets += len(packets)
+                return packets
+            except ConnectionResetError:
+                # Windows reports an ICMP port unreachable as a reset on the
+                # next receive, the socket itself still works
+                continue
+            except OSError as e:
+                # Windows fails the receive of a datagram larger than the
+                # read size instead of truncating it
+                if e.errno in self.MSGSIZE_ERRORS:
+                    self.truncated += 1
+                    continue
+                raise
+
+            if size > self.max_packet_size:
+                self.truncated += 1
+                continue
+
+            packets.append(self.view[offset:offset+size])
+            offset += size
+
+            if self.capture is not None:
+                self.capture.write(self.capture_port, packets[-1])
+
+        # The budget ran out before the socket was empty
+        self.overflows += 1
+        self.packets += len(packets)
+        return packets
+
+    def stats(self):
+        return "%d packets, %d truncated, %d overflows, %d byte socket buffer" % (self.packets, self.truncated, self.overflows, self.recv_buffer_size)
+
+class PacketCapture():
+    """Appends every received datagram to a binary log with its arrival
+    time, so that a session can be replayed later with
+    Tools/osc_replay.py. The file starts with MAGIC and is followed by
+    entries of a little-endian double time, an unsigned short port and an
+    unsigned int size, and then size bytes of the datagram. The times are
+    seconds on the monotonic clock since the session started. Each session
+    begins with an entry of size 0 whose time is the wall clock time it
+    started at, so several sessions can be appended to one file.
+
+    The receivers of all ports share one capture, so writes are locked.
+    They're buffered and flushed to the file once a second."""
+
+    MAGIC = b"NIMCAP1\x00"
+    ENTRY = struct.Struct("<dHI")
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.file = open(path, "ab")
+
+        if self.file.tell() == 0:
+            self.file.write(self.MAGIC)
+        self.file.write(self.ENTRY.pack(time.time(), 0, 0))
+
+        self.start = time.perf_counter()
+        self.flush_interval = flush_interval
+        self.last_flush = self.start
+        self.lock = threading.Lock()
+
+        self.packets = 0
+        self.bytes = 0
+
+    def write(self, port, data):
+        now = time.perf_counter()
+
+        with self.lock:
+            if self.file is None:
+                return
+
+            self.file.write(self.ENTRY.pack(now - self.start, port, len(data)))
+            self.file.write(data)
+            self.packets += 1
+            self.bytes += len(data)
+
+            if now - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def stats(self):
+        return "%d packets, %d bytes to %s" % (self.packets, self.bytes, self.path)
+
+class TakeWriter():
+    """Streams the received joints to a take on disk while receiving, so a
+    long session never has to fit in memory, and the take can be baked
+    later in any of the NI mate plugins. A take is a directory with
+    take.json, holding the metadata and the joint table, and one file of
+    float32 rows per joint. Each row is the time in seconds from the start
+    of the take, the location x, y, z and the rotation w, x, y, z in the
+    coordinates NI mate sends, with NaN for a value the joint didn't have.
+    read_take() opens the rows as numpy.memmap arrays.
+
+    location_func and rotation_func convert the joint values of the plugin
+    back to NI mate's coordinates. An existing take isn't overwritten, a
+    number is added to the path instead. The files are flushed and the
+    joint table is rewritten once a second. The receivers of several ports
+    can share a writer, also from their network threads."""
+
+    VERSION = 1
+    COLUMNS = ("time", "x", "y", "z", "qw", "qx", "qy", "qz")
+    ROW = struct.Struct("<8f")
+    NO_LOCATION = (float("nan"),)*3
+    NO_ROTATION = (float("nan"),)*4
+
+    def __init__(self, path, application, location_func=tuple, rotation_func=tuple, flush_interval=1.0):
+        path = os.path.normpath(path)
+        self.path = path
+        number = 1
+
+        while os.path.exists(os.path.join(self.path, "take.json")):
+            number += 1
+            self.path = "%s_%d" % (path, number)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.metadata = {
+            "format": "NI mate take",
+            "version": self.VERSION,
+            "application": application,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "columns": list(self.COLUMNS),
+            "duration": 0.0,
+            "joints": [],
+        }
+
+        self.location_func = location_func
+        self.rotation_func = rotation_func
+        self.files = {}
+        self.start = None
+        self.rows = 0
+        self.lock = threading.Lock()
+
+        self.flush_interval = flush_interval
+        self.last_flush = time.perf_counter()
+        self.write_table()
+
+    def write_table(self):
+        # Replaced in one go, so a reader never sees a partial table
+        temp_path = os.path.join(self.path, "take.json.tmp")
+
+        with open(temp_path, "w") as f:
+            json.dump(self.metadata, f, indent=1)
+
+        os.replace(temp_path, os.path.join(self.path, "take.json"))
+
+    def write_row(self, name, seconds, location, rotation):
+        f = self.files.get(name)
+
+        if f is None:
+            filename = "joint%03d.f4" % len(self.files)
+            f = open(os.path.join(self.path, filename), "wb")
+            self.files[name] = f
+            self.metadata["joints"].append({"name": name, "file": filename})
+            self.write_table()
+
+        f.write(self.ROW.pack(seconds, *(location + rotation)))
+        self.rows += 1
+
+    def add_frame(self, timestamp, location_dict, rotation_dict, skip=()):
+        """Writes a row for every joint of a received frame, timestamp is in
+        seconds on any clock that doesn't jump. The names in skip, those of
+        one value messages, aren't joints and are left out."""
+        with self.lock:
+            if self.start is None:
+                self.start = timestamp
+            seconds = timestamp - self.start
+
+            for name, location in location_dict.items():
+                if name not in skip:
+                    rotation = rotation_dict.get(name)
+                    self.write_row(name, seconds, tuple(self.location_func(location)), self.NO_ROTATION if rotation is None else tuple(self.rotation_func(rotation)))
+
+            for name, rotation in rotation_dict.items():
+                if name not in location_dict:
+                    self.write_row(name, seconds, self.NO_LOCATION, tuple(self.rotation_func(rotation)))
+
+            self.metadata["duration"] = seconds
+
+            if time.perf_counter() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+        self.write_table()
+        self.last_flush = time.perf_counter()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+
+            for f in self.files.values():
+                f.close()
+            self.files.clear()
+
+    def stats(self):
+        return "%d rows of %d joints to %s" % (self.rows, len(self.metadata["joints"]), self.path)
+
+def read_take(path):
+    """Opens a take written by TakeWriter. Returns its metadata and a dict
+    of read-only numpy.memmap arrays of shape (rows, 8) keyed by joint
+    name, with the columns in TakeWriter.COLUMNS. A row that was cut off
+    while the take was written is left out."""
+    with open(os.path.join(path, "take.json")) as f:
+        metadata = json.load(f)
+
+    if metadata.get("format") != "NI mate take" or metadata.get("version", 0) > TakeWriter.VERSION:
+        raise ValueError("%s isn't a supported NI mate take" % path)
+
+    joints = {}
+
+    for joint in metadata["joints"]:
+        filename = os.path.join(path, joint["file"])
+        rows = os.path.getsize(filename) // TakeWriter.ROW.size
+
+        if rows > 0:
+            joints[joint["name"]] = numpy.memmap(filename, dtype="<f4", mode="r", shape=(rows, len(TakeWriter.COLUMNS)))
+
+    return (metadata, joints)
+
+def lerp(a, b, t):
+    return [a[i] + (b[i]-a[i])*t for i in range(len(a))]
+
+class SyncScheduler(threading.Thread):
+    """Waits for the receivers' sockets in the background, drains them and
+    posts the command to Maya's main thread with executeDeferred as soon as
+    a complete frame has arrived, a sync message or a bundle. Without sync
+    messages, or when idle_updates is set for a jitter buffer that has to
+    be sampled between frames, the command is also posted every interval
+    seconds.
+
+    Only one call is pending at a time. Packets that arrive before it runs
+    are handed to the same call through take(), so frames coalesce instead
+    of queuing up behind a busy main thread. The datagrams are copied out
+    of the reader's buffer, since the next drain reuses it."""
+
+    def __init__(self, receivers, command, interval=1.0/30.0, idle_updates=False):
+        threading.Thread.__init__(self, name="NI mate scheduler", daemon=True)
+        self.receivers = receivers
+        self.command = command
+        self.interval = interval
+        self.idle_updates = idle_updates
+        self.selector = selectors.DefaultSelector()
+
+        for receiver in receivers:
+            self.selector.register(receiver.sock, selectors.EVENT_READ, receiver)
+
+        self.lock = threading.Lock()
+        self.packets = dict((receiver, []) for receiver in receivers)
+        self.pending = False
         self.running = True
-        self.command = cmd
-        self.counter = 0
-        threading.Thread.__init__(self)
+
+        self.posted = 0
+        self.coalesced = 0
+
         self.start()
-        
-    def __del__(self):
-        self.running = False
-        time.sleep(1.0/15.0)
-        
+
     def run(self):
-        while(self.running):
-            time.sleep(1.0/30.0)
-            utils.executeInMainThreadWithResult(self.command)
+        last_post = time.perf_counter()
+
+        while self.running:
+            complete = False
+
+            for key, events in self.selector.select(self.interval):
+                packets = [bytes(data) for data in key.data.reader.drain()]
+
+                for data in packets:
+                    if data.startswith(b"/NI_mate_sync") or data.startswith(b"#bundle"):
+                        complete = True
+
+                with self.lock:
+                    self.packets[key.data].extend(packets)
+
+            now = time.perf_counter()
+
+            with self.lock:
+                if self.pending:
+                    if complete:
+                        self.coalesced += 1
+                    continue
+
+                waiting = self.idle_updates or any(len(packets) > 0 for packets in self.packets.values())
+
+                if not complete and not (waiting and now - last_post >= self.interval):
+                    continue
+
+                self.pending = True
+
+            last_post = now
+            self.posted += 1
+            utils.executeDeferred(self.command)
+
+    def take(self):
+        """Returns the packets received for each receiver since the last
+        call, and lets the next call be posted."""
+        with self.lock:
+            packets = self.packets
+            self.packets = dict((receiver, []) for receiver in self.receivers)
+            self.pending = False
+        return packets
 
     def stop(self):
         self.running = False
+        self.join()
+        self.selector.close()
+
+    def stats(self):
+        return "%d updates, %d frames coalesced" % (self.posted, self.coalesced)
+
+class JitterBuffer():
+    """Buffers complete skeleton frames with their arrival times, or the
+    sender's bundle timetags, and plays them back with a fixed delay by
+    interpolating between the two frames around the delayed time. A longer
+    delay hides more network and timer jitter at the cost of latency.
+    Locations are interpolated with lerp_func and rotations with
+    slerp_func, both called as func(a, b, t)."""
+
+    def __init__(self, delay, lerp_func, slerp_func, max_frames=120):
+        self.delay = delay
+        self.lerp = lerp_func
+        self.slerp = slerp_func
+        self.frames = collections.deque(maxlen=max_frames)
+        self.lock = threading.Lock()
+        self.clock_offset = None
+
+        self.received = 0
+        self.dropped = 0
+        self.samples = 0
+        self.underruns = 0
+
+        # The time of the frame sample() returned last, which stays the
+        # same while a frame is held
+        self.sampled_time = None
+
+    def add(self, location_dict, rotation_dict, timestamp=None):
+        """Adds a complete frame. The timestamp is the sender's time in
+        seconds, without it the frame is timed by its arrival."""
+        now = time.perf_counter()
+
+        if timestamp is not None:
+            # The smallest difference between the local and sender clocks
+            # belongs to the least delayed frame. A large jump means the
+            # sender's clock was reset.
+            offset = now - timestamp
+            if self.clock_offset is None or offset < self.clock_offset or offset - self.clock_offset > 1.0:
+                self.clock_offset = offset
+            now = timestamp + self.clock_offset
+
+        with self.lock:
+            self.received += 1
+
+            if len(self.frames) > 0 and now <= self.frames[-1][0]:
+                # Arrived out of order
+                self.dropped += 1
+                return
+
+            self.frames.append((now, location_dict, rotation_dict))
+
+    def sample(self):
+        """Returns the location and rotation dicts for the current time
+        minus the delay, or None if no frames have been received."""
+        target = time.perf_counter() - self.delay
+
+        with self.lock:
+            frames = self.frames
+            while len(frames) > 1 and frames[1][0] <= target:
+                frames.popleft()
+
+            if len(frames) == 0:
+                return None
+
+            self.samples += 1
+            time0, location0, rotation0 = frames[0]
+
+            if target <= time0:
+                self.sampled_time = time0
+                return (location0, rotation0)
+
+            if len(frames) == 1:
+                # No newer frame arrived in time, hold the last one
+                self.underruns += 1
+                self.sampled_time = time0
+                return (location0, rotation0)
+
+            time1, location1, rotation1 = frames[1]
+            self.sampled_time = target
+
+        t = (target - time0) / (time1 - time0)
 
-class NImateReceiver():
-    def run(self, create, record, scaling, createRoot, root_name):
         location_dict = {}
+        for key, value in location1.items():
+            previous = location0.get(key)
+            location_dict[key] = value if previous is None else self.lerp(previous, value, t)
+
         rotation_dict = {}
-        
+        for key, value in rotation1.items():
+            previous = rotation0.get(key)
+            rotation_dict[key] = value if previous is None else self.slerp(previous, value, t)
+
+        return (location_dict, rotation_dict)
+
+    def stats(self):
+        return "%d frames, %d dropped, %d underruns in %d updates with %d ms delay" % (self.received, self.dropped, self.underruns, self.samples, 1000*self.delay)
+
+class Predictor():
+    """Extrapolates each joint forward by horizon seconds from its velocity
+    over the last few complete frames, to hide the latency between the
+    sensor and the viewport. The velocity is the change between the oldest
+    and newest remembered frame, so extrapolating reuses the interpolation
+    functions with a factor above 1. Joints whose rotation is_lost_func
+    reports as untracked are applied as received and their history is
+    cleared, so a joint doesn't keep moving after tracking is lost."""
+
+    def __init__(self, horizon, lerp_func, slerp_func, is_lost_func, history=3, max_gap=0.25, max_factor=2.0):
+        self.horizon = horizon
+        self.lerp = lerp_func
+        self.slerp = slerp_func
+        self.is_lost = is_lost_func
+        self.history = history
+        self.max_gap = max_gap
+        self.max_factor = max_factor
+
+        self.locations = {}
+        self.rotations = {}
+
+        self.frames = 0
+        self.clamped = 0
+
+        self.last_time = None
+        self.last_prediction = None
+
+    def extrapolate(self, samples, key, now, value, func):
+        history = samples.get(key)
+
+        # After a gap the old frames say nothing about the current velocity
+        if history is None or now - history[-1][0] > self.max_gap:
+            history = collections.deque(maxlen=self.history)
+            samples[key] = history
+
+        history.append((now, value))
+        time0, value0 = history[0]
+
+        if now <= time0:
+            return value
+
+        # Extrapolating far beyond the measured interval amplifies noise
+        # more than it hides latency
+        t = 1.0 + min(self.horizon / (now - time0), self.max_factor)
+        return func(value0, value, t)
+
+    def predict(self, location_dict, rotation_dict, now):
+        """Returns new location and rotation dicts predicted from a complete
+        frame received at now, in seconds on the perf_counter clock. A frame
+        that isn't newer than the last one, such as a held frame, would
+        stop the joints, so the last prediction is returned for it."""
+        if self.last_time is not None and now <= self.last_time:
+            return self.last_prediction
+
+        self.last_time = now
+        self.frames += 1
+
+        lost = set()
+        predicted_rotations = {}
+        for key, value in rotation_dict.items():
+            if self.is_lost(value):
+                lost.add(key)
+                self.locations.pop(key, None)
+                self.rotations.pop(key, None)
+                self.clamped += 1
+                predicted_rotations[key] = value
+            else:
+                predicted_rotations[key] = self.extrapolate(self.rotations, key, now, value, self.slerp)
+
+        predicted_locations = {}
+        for key, value in location_dict.items():
+            if key in lost:
+                predicted_locations[key] = value
+            else:
+                predicted_locations[key] = self.extrapolate(self.locations, key, now, value, self.lerp)
+
+        self.last_prediction = (predicted_locations, predicted_rotations)
+        return self.last_prediction
+
+    def stats(self):
+        return "%d frames, %d lost joints held with %d ms horizon" % (self.frames, self.clamped, 1000*self.horizon)
+
+class JointRecord():
+    """A joint's location and rotation. The records are allocated once per
+    joint and updated in place from every frame, so receiving doesn't
+    create new objects for the garbage collector to track."""
+    __slots__ = ("name", "location", "rotation")
+
+    def __init__(self, name):
+        self.name = name
+        self.location = [0.0, 0.0, 0.0]
+        self.rotation = om.MQuaternion()
+
+class JointPool():
+    """The joint records of one frame, keyed by the OSC address so that
+    each joint name is prefixed and interned only once. location_dict and
+    rotation_dict hold the records set since begin() and are cleared
+    instead of replaced. The values are overwritten by the next frame, so
+    anything that keeps them has to use copy_dicts()."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.records = {}
+        self.location_dict = {}
+        self.rotation_dict = {}
+
+    def record(self, address):
+        record = self.records.get(address)
+
+        if record is None:
+            record = JointRecord(sys.intern(self.prefix + address))
+            self.records[address] = record
+
+        return record
+
+    def location(self, address):
+        record = self.record(address)
+        self.location_dict[record.name] = record.location
+        return record.location
+
+    def rotation(self, address):
+        record = self.record(address)
+        self.rotation_dict[record.name] = record.rotation
+        return record.rotation
+
+    def begin(self):
+        self.location_dict.clear()
+        self.rotation_dict.clear()
+
+    def copy_dicts(self):
+        return (dict((key, list(value)) for key, value in self.location_dict.items()),
+                dict((key, om.MQuaternion(value)) for key, value in self.rotation_dict.items()))
+
+# The (undo, redo) pairs the NImateUndo command takes
+undo_changes = []
+undo_plugin = None
+
+def load_undo_plugin():
+    """Loads the NImateUndo plug-in from the plug-ins folder next to the
+    scripts folder, returns False if it isn't available."""
+    global undo_plugin
+
+    if undo_plugin is None:
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plug-ins", "NImateUndo.py")
+
+        try:
+            if not cmds.pluginInfo("NImateUndo", query=True, loaded=True):
+                cmds.loadPlugin(path, quiet=True)
+            undo_plugin = True
+        except RuntimeError:
+            print("-> Delicode NI mate receiver couldn't load " + path + ", the locators and keys it creates can't be undone")
+            undo_plugin = False
+
+    return undo_plugin
+
+def push_undo(changes):
+    """Puts changes made through the API, a list of (undo, redo) pairs, on
+    the undo queue as one step with the NImateUndo command. Without the
+    plug-in they can't be undone and are dropped."""
+    if len(changes) > 0 and load_undo_plugin():
+        undo_changes.extend(changes)
         try:
-            data = self.sock.recv( 1024 )
-        except:
+            cmds.NImateUndo()
+        finally:
+            del undo_changes[:]
+
+def take_undo():
+    """Called by the NImateUndo command."""
+    changes = list(undo_changes)
+    del undo_changes[:]
+    return changes
+
+class SceneIndex():
+    """Maps node names to the MDagPaths and MFnTransforms of transforms, so
+    that joints are found without listing the whole scene. A name is
+    looked up with the API the first time it's needed, names without a
+    transform are cached too. Node added, removed, renamed and reparented
+    callbacks drop the affected names, which are then looked up again.
+
+    The names known to be under the root object are kept in rooted, so the
+    hierarchy is only checked again after it changes."""
+
+    def __init__(self):
+        self.transforms = {}
+        self.rooted = set()
+        self.callbacks = []
+
+        self.callbacks.append(om.MDGMessage.addNodeAddedCallback(self.node_changed, "transform"))
+        self.callbacks.append(om.MDGMessage.addNodeRemovedCallback(self.node_changed, "transform"))
+        self.callbacks.append(om.MNodeMessage.addNameChangedCallback(om.MObject(), self.name_changed))
+        self.callbacks.append(om.MDagMessage.addAllDagChangesCallback(self.dag_changed))
+
+    def forget(self, name):
+        self.transforms.pop(name, None)
+        self.rooted.discard(name)
+
+    def node_changed(self, node, clientData=None):
+        self.forget(om.MFnDependencyNode(node).name())
+
+    def name_changed(self, node, previous, clientData=None):
+        self.forget(previous)
+        self.node_changed(node)
+
+    def dag_changed(self, message, child, parent, clientData=None):
+        self.forget(child.partialPathName())
+
+    def get(self, name):
+        """Returns the MFnTransform of the transform with the name, or None
+        if there isn't one."""
+        xformFn = self.transforms.get(name, self)
+
+        if xformFn is self:
+            xformFn = None
+            selection = om.MSelectionList()
+            path = om.MDagPath()
+
+            try:
+                selection.add(name)
+                selection.getDagPath(0, path)
+                if path.hasFn(om.MFn.kTransform):
+                    xformFn = om.MFnTransform(path)
+            except RuntimeError:
+                pass
+
+            self.transforms[name] = xformFn
+
+        return xformFn
+
+    def prepare(self, names, create, root_name=None):
+        """Makes sure there's a transform for each name, creating missing
+        locators if create is set, and that they're under the root object
+        if root_name is given. Everything that's missing is created and
+        parented with one MDagModifier, which is put on the undo queue with
+        the NImateUndo command so it's undone as one step. Names already
+        under the root are skipped without looking at the hierarchy."""
+        modifier = None
+        root = None
+        rooted = []
+
+        if root_name is not None:
+            rootFn = self.get(root_name)
+            if rootFn is None:
+                modifier = om.MDagModifier()
+                root = modifier.createNode("locator")
+                modifier.renameNode(root, root_name)
+            else:
+                root = rootFn.object()
+
+        for name in names:
+            xformFn = self.get(name)
+
+            if xformFn is None:
+                if not create:
+                    continue
+            elif root is None or name in self.rooted:
+                continue
+
+            if modifier is None:
+                modifier = om.MDagModifier()
+
+            if xformFn is None:
+                # Creating a shape also creates its transform, which is
+                # returned and placed under the given parent
+                node = modifier.createNode("locator", root if root is not None else om.MObject())
+                modifier.renameNode(node, name)
+            elif xformFn.dagPath().length() == 1:
+                modifier.reparentNode(xformFn.object(), root)
+
+            if root is not None:
+                rooted.append(name)
+
+        if modifier is not None:
+            modifier.doIt()
+            push_undo([(modifier.undoIt, modifier.doIt)])
+
+        # After doIt, whose callbacks forget the changed names
+        self.rooted.update(rooted)
+
+    def remove_callbacks(self):
+        for callback in self.callbacks:
+            om.MMessage.removeCallback(callback)
+        self.callbacks = []
+        self.transforms.clear()
+        self.rooted.clear()
+
+class TakeRecorder():
+    """Records the joint transforms into arrays while receiving and writes
+    them to the animation curves with one MFnAnimCurve.addKeys call per
+    channel, instead of a setKeyframe command per channel on every update.
+    The curves are written when flush() is called, on stop or every
+    flush_interval seconds.
+
+    Each rotation is stored as the Euler solution closest to the previous
+    sample of the joint, so the curves don't flip between equivalent
+    angles and need no Euler filter afterwards."""
+
+    TRANSLATE = ("translateX", "translateY", "translateZ")
+    ROTATE = ("rotateX", "rotateY", "rotateZ")
+
+    def __init__(self, scene, flush_interval=0.0):
+        self.scene = scene
+        self.flush_interval = flush_interval
+        self.last_flush = time.perf_counter()
+        self.time = 0.0
+        self.channels = {}
+        self.eulers = {}
+
+        # The (undo, redo) pairs of the take, with one MAnimCurveChange per
+        # curve that collects all of its keys
+        self.changes = []
+        self.curve_changes = {}
+
+    def begin_frame(self):
+        """Reads the current time the samples until the next call are keyed at."""
+        self.time = oma.MAnimControl.currentTime().value()
+
+    def add(self, name, attributes, values):
+        for attribute, value in zip(attributes, values):
+            channel = self.channels.get((name, attribute))
+
+            if channel is None:
+                channel = (array.array('d'), array.array('d'))
+                self.channels[(name, attribute)] = channel
+
+            times, samples = channel
+
+            if len(times) > 0 and self.time <= times[-1]:
+                if self.time == times[-1]:
+                    samples[-1] = value
+                    continue
+                # The time went back, so the keys so far are written first
+                self.flush_channel(name, attribute, times, samples)
+
+            times.append(self.time)
+            samples.append(value)
+
+    def add_translation(self, name, xformFn):
+        translation = xformFn.getTranslation(om.MSpace.kTransform)
+        self.add(name, self.TRANSLATE, (translation.x, translation.y, translation.z))
+
+    def add_rotation(self, name, xformFn):
+        euler = om.MEulerRotation()
+        xformFn.getRotation(euler)
+
+        previous = self.eulers.get(name)
+        if previous is not None:
+            euler.setToClosestSolution(previous)
+        self.eulers[name] = euler
+
+        self.add(name, self.ROTATE, (euler.x, euler.y, euler.z))
+
+    def due(self):
+        return self.flush_interval > 0 and time.perf_counter() - self.last_flush >= self.flush_interval
+
+    def flush_channel(self, name, attribute, times, samples):
+        xformFn = self.scene.get(name)
+
+        if xformFn is not None and len(times) > 0:
+            plug = xformFn.findPlug(attribute)
+            curves = om.MObjectArray()
+            curveFn = oma.MFnAnimCurve()
+
+            if oma.MAnimUtil.findAnimation(plug, curves):
+                curveFn.setObject(curves[0])
+            else:
+                # The curve is created and connected by the modifier, so
+                # undoing it removes the curve
+                modifier = om.MDGModifier()
+                curveFn.create(plug, modifier)
+                modifier.doIt()
+                self.changes.append((modifier.undoIt, modifier.doIt))
+
+            timeArray = om.MTimeArray()
+            valueArray = om.MDoubleArray()
+            unit = om.MTime.uiUnit()
+
+            for t, value in zip(times, samples):
+                timeArray.append(om.MTime(t, unit))
+                valueArray.append(value)
+
+            change = self.curve_changes.get((name, attribute))
+            if change is None:
+                change = oma.MAnimCurveChange()
+                self.curve_changes[(name, attribute)] = change
+                self.changes.append((change.undoIt, change.redoIt))
+
+            curveFn.addKeys(timeArray, valueArray, oma.MFnAnimCurve.kTangentGlobal, oma.MFnAnimCurve.kTangentGlobal, True, change)
+
+        del times[:]
+        del samples[:]
+
+    def flush(self):
+        """Writes the recorded samples to the animation curves."""
+        for (name, attribute), (times, samples) in self.channels.items():
+            try:
+                self.flush_channel(name, attribute, times, samples)
+            except RuntimeError as e:
+                print("-> Delicode NI mate receiver couldn't key " + name + "." + attribute + ": " + str(e))
+                del times[:]
+                del samples[:]
+
+        self.last_flush = time.perf_counter()
+
+    def end_take(self):
+        """Writes the remaining samples and puts everything keyed since the
+        take started on the undo queue as one step. The step holds one
+        change per curve however often the keys were flushed, so a take
+        adds one entry to the undo queue."""
+        self.flush()
+        push_undo(self.changes)
+        self.changes = []
+        self.curve_changes.clear()
+
+def bake_take(path, scene, scaling, create, root_name):
+    """Keys the motion of a take written by TakeWriter on the locators
+    named after its joints, starting from the current time. The values are
+    converted the same way as when receiving, and keyed with a
+    TakeRecorder. The locators and keys are undone as one step."""
+    metadata, joints = read_take(path)
+
+    cmds.undoInfo(openChunk=True, chunkName="Bake NI mate take")
+    try:
+        bake_joints(joints, scene, scaling, create, root_name)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+
+def bake_joints(joints, scene, scaling, create, root_name):
+    if create or root_name is not None:
+        scene.prepare(list(joints), create, root_name)
+
+    recorder = TakeRecorder(scene)
+    start = oma.MAnimControl.currentTime().value()
+    fps = om.MTime(1.0, om.MTime.kSeconds).asUnits(om.MTime.uiUnit())
+
+    for name, rows in joints.items():
+        xformFn = scene.get(name)
+        if xformFn is None:
+            continue
+
+        # The rotations are keyed in the locator's own rotation order
+        current = om.MEulerRotation()
+        xformFn.getRotation(current)
+        previous = None
+
+        for seconds, x, y, z, qw, qx, qy, qz in rows.tolist():
+            recorder.time = start + fps*seconds
+
+            if not math.isnan(x):
+                recorder.add(name, TakeRecorder.TRANSLATE, (-x*scaling, y*scaling, z*scaling))
+
+            if not math.isnan(qw):
+                euler = om.MQuaternion(qx, qy, qz, qw).asEulerRotation()
+                euler.reorderIt(current.order)
+
+                if previous is not None:
+                    euler.setToClosestSolution(previous)
+                previous = euler
+
+                recorder.add(name, TakeRecorder.ROTATE, (euler.x, euler.y, euler.z))
+
+    recorder.end_take()
+
+class NImateReceiver():
+    jitter = None
+    predictor = None
+    synced = False
+    take = None
+    prefix = ""
+    pool = None
+    next_pool = None
+
+    def parse_message(self, decoded, location_dict, rotation_dict):
+        """Stores the joint data of a decoded OSC message in the dicts.
+        Returns True if the message is the sync message ending a frame."""
+        ob_name = str(decoded[0])
+        
+        if (len(decoded) == 3):     # one value
+            return ob_name == "/NI_mate_sync"
+        elif (len(decoded) == 5):   # location
+            location_dict[self.prefix + ob_name] = ([decoded[2], decoded[3], decoded[4]])
+        elif (len(decoded) == 6):   # quaternion
+            rotation_dict[self.prefix + ob_name] = om.MQuaternion(decoded[3], decoded[4], decoded[5], decoded[2])
+        elif (len(decoded) == 9):   # location & quaternion
+            location_dict[self.prefix + ob_name] = ([decoded[2], decoded[3], decoded[4]])
+            rotation_dict[self.prefix + ob_name] = om.MQuaternion(decoded[6], decoded[7], decoded[8], decoded[5])
+
+        return False
+
+    def parse_bundle(self, decoded):
+        """Returns the location and rotation dicts of the skeleton frame in
+        a decoded bundle."""
+        location_dict = {}
+        rotation_dict = {}
+
+        for message in OSC.bundleMessages(decoded):
+            self.parse_message(message, location_dict, rotation_dict)
+
+        return (location_dict, rotation_dict)
+
+    def parse_pooled(self, decoded, pool):
+        """Same as parse_message, but stores the joint data in the reused
+        records of a JointPool instead of allocating new values. Returns
+        True if the message is the sync message ending a frame."""
+        address = decoded[0]
+        count = len(decoded)
+
+        if (count == 3):     # one value
+            return address == "/NI_mate_sync"
+
+        if (count == 5 or count == 9):   # location
+            location = pool.location(address)
+            location[0] = decoded[2]
+            location[1] = decoded[3]
+            location[2] = decoded[4]
+
+        if (count == 6):     # quaternion
+            rotation = pool.rotation(address)
+            rotation.x = decoded[3]
+            rotation.y = decoded[4]
+            rotation.z = decoded[5]
+            rotation.w = decoded[2]
+        elif (count == 9):   # location & quaternion
+            rotation = pool.rotation(address)
+            rotation.x = decoded[6]
+            rotation.y = decoded[7]
+            rotation.z = decoded[8]
+            rotation.w = decoded[5]
+
+        return False
+
+    def receive_frames(self, decoded):
+        """Adds the complete frames to the jitter buffer, and writes them to
+        the take."""
+        if decoded[0] == "#bundle":
+            location_dict, rotation_dict = self.parse_bundle(decoded)
+            self.synced = True
+            self.jitter.add(location_dict, rotation_dict, OSC.timetagToSeconds(decoded[1]))
+        elif self.parse_message(decoded, self.location_dict, self.rotation_dict):
+            self.synced = True
+            location_dict, rotation_dict = self.location_dict, self.rotation_dict
+            self.jitter.add(location_dict, rotation_dict)
+            self.location_dict = {}
+            self.rotation_dict = {}
+        else:
+            return
+
+        if self.take is not None:
+            self.take.add_frame(time.perf_counter(), location_dict, rotation_dict)
+
+    def run(self, create, record, scaling, createRoot, root_name, packets=None, refresh=True):
+        """Applies the received data. The packets are read from the socket
+        unless they are given. record is the TakeRecorder of the take, or
+        None when not recording."""
+        if packets is None:
+            packets = self.reader.drain()
+        if len(packets) == 0 and self.jitter is None:
             return True
-        trash = data
         
-        while(True):
-            data = trash
+        # Without the jitter buffer the frames are applied right away, so
+        # they're assembled into two pools of reused joint records: the
+        # frame being received and the newest complete one. A frame
+        # completed later in the same update replaces the older one.
+        pool = None
+        if not self.synced:
+            self.pool.begin()
+        
+        for data in packets:
             decoded = OSC.decodeOSC(data)
             
-            # Create root object for easier scaling
-            if createRoot:
-                if not root_name in cmds.ls(objectsOnly=True):
-                    cmds.spaceLocator(name=root_name, position=(0,0,0))
-            
-            ob_name = str(decoded[0])
+            if len(decoded) > 0 and self.jitter is not None:
+                self.receive_frames(decoded)
+            elif len(decoded) > 0 and decoded[0] == "#bundle":
+                # A bundle carries a whole skeleton frame, so it's used as
+                # one frame without waiting for the sync message
+                pool = self.next_pool
+                pool.begin()
+                for message in OSC.bundleMessages(decoded):
+                    self.parse_pooled(message, pool)
+                self.synced = True
+                
+                if self.take is not None:
+                    self.take.add_frame(time.perf_counter(), pool.location_dict, pool.rotation_dict)
+            elif len(decoded) > 0 and self.parse_pooled(decoded, self.pool):
+                # The messages after the sync message start the next frame
+                self.pool, self.next_pool = self.next_pool, self.pool
+                self.pool.begin()
+                pool = self.next_pool
+                self.synced = True
+                
+                if self.take is not None:
+                    self.take.add_frame(time.perf_counter(), pool.location_dict, pool.rotation_dict)
+        
+        if self.jitter is not None:
+            # Without sync messages or bundles there are no frames, so the
+            # latest values are buffered as they arrive
+            if not self.synced and len(packets) > 0:
+                self.jitter.add(self.location_dict.copy(), self.rotation_dict.copy())
+                
+                if self.take is not None:
+                    self.take.add_frame(time.perf_counter(), self.location_dict, self.rotation_dict)
+
+            frame = self.jitter.sample()
+            if frame is None:
+                return True
+            location_dict, rotation_dict = frame
+        else:
+            if pool is None:
+                if self.synced:
+                    # No frame was completed in this update
+                    return True
+                
+                # Without sync messages or bundles there are no frames, so
+                # everything received in the update is applied
+                pool = self.pool
+                
+                if self.take is not None:
+                    self.take.add_frame(time.perf_counter(), pool.location_dict, pool.rotation_dict)
             
-            if (len(decoded) == 5):     # location
-                location_dict[ob_name] = ([decoded[2], decoded[3], decoded[4]])
-            elif (len(decoded) == 6):   # quaternion
-                rotation_dict[ob_name] = om.MQuaternion(decoded[3], decoded[4], decoded[5], decoded[2])
-            elif (len(decoded) == 9):   # location & quaternion
-                location_dict[ob_name] = ([decoded[2], decoded[3], decoded[4]])
-                rotation_dict[ob_name] = om.MQuaternion(decoded[6], decoded[7], decoded[8], decoded[5])
-            try:
-                trash = self.sock.recv(1024)
-            except:
-                break
+            location_dict = pool.location_dict
+            rotation_dict = pool.rotation_dict
+        
+        if self.predictor is not None:
+            if self.jitter is None:
+                # The predictor keeps the values, so it gets copies of the records
+                location_dict, rotation_dict = pool.copy_dicts()
+                frame_time = time.perf_counter()
+            else:
+                # A frame held by the jitter buffer keeps its time
+                frame_time = self.jitter.sampled_time
+            location_dict, rotation_dict = self.predictor.predict(location_dict, rotation_dict, frame_time)
+        
+        # Create the missing locators, and the root object for easier
+        # scaling, in one go
+        if create or createRoot:
+            self.scene.prepare(itertools.chain(location_dict, rotation_dict), create, root_name if createRoot else None)
+        
+        if record is not None:
+            record.begin_frame()
         
         # Handle locations
         for key, value in location_dict.items():
-            if key in cmds.ls(objectsOnly=True):
-                cmds.move(-value[0]*scaling, value[1]*scaling, value[2]*scaling, key, absolute=True, localSpace=True)
-                if createRoot:
-                    l = cmds.listRelatives(key, allParents=True)
-                    if (l == None):
-                        cmds.parent(key, root_name)
-                if record:
-                    cmds.setKeyframe(key, attribute='translateX')
-                    cmds.setKeyframe(key, attribute='translateY')
-                    cmds.setKeyframe(key, attribute='translateZ')
-            elif create:
-                cmds.spaceLocator(name=key, position=(0,0,0))
-                cmds.move(-value[0]*scaling, value[1]*scaling, value[2]*scaling, key, absolute=True, localSpace=True)
-                if createRoot:
-                    l = cmds.listRelatives(key, allParents=True)
-                    if (l == None):
-                        cmds.parent(key, root_name)
-                if record:
-                    cmds.setKeyframe(key, attribute='translateX')
-                    cmds.setKeyframe(key, attribute='translateY')
-                    cmds.setKeyframe(key, attribute='translateZ')
+            xformFn = self.scene.get(key)
+            if xformFn is None:
+                continue
+            xformFn.setTranslation(om.MVector(-value[0]*scaling, value[1]*scaling, value[2]*scaling), om.MSpace.kTransform)
+            if record is not None:
+                record.add_translation(key, xformFn)
         
         # Handle orientations
         for key, value in rotation_dict.items():
-            if not key in cmds.ls(objectsOnly=True) and create:
-                cmds.spaceLocator(name=key, position=(0,0,0))
+            xformFn = self.scene.get(key)
+            if xformFn is None:
+                continue
             try:
-                if createRoot:
-                    l = cmds.listRelatives(key, allParents=True)
-                    if (l == None):
-                        cmds.parent(key, root_name)
-                cmds.select(key)
-                list = om.MSelectionList()
-                om.MGlobal.getActiveSelectionList(list)
-                obj = om.MObject()
-                list.getDependNode( 0, obj )
-                q = om.MQuaternion(value)
-                xformFn = om.MFnTransform(obj)
-                
                 # Maya seems to dislike quaternions with w set to -0.00
                 # This happens if orientation for a limb is not found
                 if (value.w != -0.00):
                     xformFn.setRotationQuaternion(value.x, value.y, value.z, value.w) # space = MSpace::kTransform
                 
-                if record:
-                    try:
-                        cmds.setKeyframe(key, attribute='rotateX')
-                        cmds.setKeyframe(key, attribute='rotateY')
-                        cmds.setKeyframe(key, attribute='rotateZ')
-                    except Warning as w:
-                        print(w)
+                if record is not None:
+                    record.add_rotation(key, xformFn)
             except Exception as e:
                 print(e)
                 continue
         
-        cmds.refresh(force=True)
+        if refresh:
+            cmds.refresh(force=True)
 
-    def __init__(self, UDP_PORT):
+    def __init__(self, UDP_PORT, SCENE_INDEX, MAX_PACKETS=1024, RECV_BUFFER_SIZE=0, JITTER_DELAY=0.0, PREDICTION=0.0, PREFIX="", CAPTURE=None, TAKE=None):
         self.sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.setblocking(0)
+        self.reader = DatagramReader(self.sock, MAX_PACKETS, recv_buffer_size=RECV_BUFFER_SIZE)
+
+        if CAPTURE is not None:
+            self.reader.capture = CAPTURE
+            self.reader.capture_port = UDP_PORT
         self.sock.bind( ("localhost", UDP_PORT) )
+        self.port = UDP_PORT
+        self.prefix = PREFIX
+        self.scene = SCENE_INDEX
+        self.take = TAKE
+
+        self.location_dict = {}
+        self.rotation_dict = {}
+        self.pool = JointPool(PREFIX)
+        self.next_pool = JointPool(PREFIX)
+
+        if JITTER_DELAY > 0:
+            self.jitter = JitterBuffer(JITTER_DELAY, lerp, om.slerp)
+
+        if PREDICTION > 0:
+            # NI mate sends a zero w for joints it can't track
+            self.predictor = Predictor(PREDICTION, lerp, om.slerp, lambda q: q.w == 0.0)
         
-        print("-> Delicode NI mate receiver started listening to OSC on port " + str(UDP_PORT))
+        print("-> Delicode NI mate receiver started listening to OSC on port " + str(UDP_PORT) + (" as " + PREFIX if PREFIX != "" else ""))
         
     def __del__(self):
         self.sock.close()
-        print("-> Delicode NI mate receiver stopped listening to OSC")
+        print("-> Delicode NI mate receiver stopped listening to OSC on port " + str(self.port) + " (" + self.reader.stats() + ")")
+
+        if self.jitter is not None:
+            print("-> Delicode NI mate receiver jitter buffer: " + self.jitter.stats())
+
+        if self.predictor is not None:
+            print("-> Delicode NI mate receiver prediction: " + self.predictor.stats())
 
     def setKey(self,obj,pos):
         return
         
+class NImateMultiReceiver():
+    """Receives from several sensors or NI mate instances, one port each,
+    with one receiver per port. The sockets are polled together with a
+    single select call per update and only the receivers with data waiting
+    are drained, the others just apply what they already have. Each
+    receiver namespaces its joint names with its own prefix, so the
+    skeletons from different sources don't overwrite each other."""
+
+    def __init__(self, receivers):
+        self.receivers = receivers
+        self.selector = selectors.DefaultSelector()
+
+        for receiver in receivers:
+            self.selector.register(receiver.sock, selectors.EVENT_READ, receiver)
+
+    def ready(self):
+        """Returns the receivers with data waiting in their sockets."""
+        return [key.data for key, events in self.selector.select(0)]
+
+    def run(self, create, record, scaling, createRoot, root_name, packets=None, refresh=True):
+        """Applies the received data. packets maps each receiver to its
+        packets, without it the sockets are polled."""
+        if packets is None:
+            ready = self.ready()
+            packets = dict((receiver, None if receiver in ready else []) for receiver in self.receivers)
+
+        for receiver in self.receivers:
+            receiver.run(create, record, scaling, createRoot, root_name, packets[receiver], False)
+
+        # One refresh for all the sources
+        if refresh and (any(p is None or len(p) > 0 for p in packets.values()) or self.receivers[0].jitter is not None):
+            cmds.refresh(force=True)
+
+    def __del__(self):
+        self.selector.close()
+
 class DelicodeNImatePreferences():
     def __init__(self, winName="NImateWindow"):
         self.winTitle = "Delicode NI mate"
         self.root_name = "nimate_root"
         self.winName = winName
-        self.timer = False
+        self.scheduler = None
         self.ServerStarted = False
         self.osc_port = 7000
         self.record = False
@@ -268,11 +1404,32 @@ class DelicodeNImatePreferences():
         self.createRoot = False
         self.ui_osc_port = None
         self.scaling = 10
+        self.max_packets = 1024
+        self.recv_buffer_size = 0
+        self.jitter_delay = 0
+        self.prediction = 0
+        self.extra_ports = ""
+        self.record_flush = 0
+        self.refresh_rate = 30
+        self.last_refresh = 0.0
+        self.capture_path = ""
+        self.capture = None
+        self.take_path = ""
+        self.take = None
         
     def __del__(self):
         if self.ServerStarted:
-            del self.timer
+            self.scheduler.stop()
+            del self.scheduler
             del self.receiver
+            self.recorder.end_take()
+            self.scene_index.remove_callbacks()
+
+            if self.capture is not None:
+                self.capture.close()
+
+            if self.take is not None:
+                self.take.close()
 
     def createUI(self):
         if cmds.window(self.winName, exists=True):
@@ -281,11 +1438,25 @@ class DelicodeNImatePreferences():
         cmds.window(self.winName, title=self.winTitle, maximizeButton=False, minimizeButton=False, resizeToFitChildren=True)
         self.mainCol = cmds.columnLayout( adjustableColumn=True )
         
-        cmds.gridLayout(numberOfRowsColumns=[2,2], cellWidthHeight=[120,20])
+        cmds.gridLayout(numberOfRowsColumns=[9,2], cellWidthHeight=[120,20])
         cmds.text('OSC port')
         self.ui_oscport = cmds.intField(minValue=0, maxValue=65535, value=self.osc_port, changeCommand=partial(self.set_port), enable=not self.ServerStarted)
+        cmds.text('Additional ports')
+        self.ui_extra_ports = cmds.textField(text=self.extra_ports, changeCommand=partial(self.set_extra_ports), enable=not self.ServerStarted, annotation='Comma separated ports of other sensors or NI mate instances, their joints are prefixed with sensor2_, sensor3_ and so on')
         cmds.text('Scale')
         self.ui_scaling = cmds.floatField(minValue=0, maxValue=1000, value=self.scaling, changeCommand=partial(self.set_scaling))
+        cmds.text('Smoothing delay (ms)')
+        self.ui_jitter_delay = cmds.intField(minValue=0, maxValue=1000, value=self.jitter_delay, changeCommand=partial(self.set_jitter_delay), enable=not self.ServerStarted)
+        cmds.text('Prediction (ms)')
+        self.ui_prediction = cmds.intField(minValue=0, maxValue=500, value=self.prediction, changeCommand=partial(self.set_prediction), enable=not self.ServerStarted)
+        cmds.text('Viewport refresh (Hz)')
+        self.ui_refresh_rate = cmds.intField(minValue=0, maxValue=240, value=self.refresh_rate, changeCommand=partial(self.set_refresh_rate), annotation='Highest rate the viewport is redrawn at while receiving, 0 redraws on every update')
+        cmds.text('Write keys every (s)')
+        self.ui_record_flush = cmds.intField(minValue=0, maxValue=3600, value=self.record_flush, changeCommand=partial(self.set_record_flush), enable=not self.ServerStarted, annotation='How often recorded motion is written to the animation curves, 0 writes it when receiving stops')
+        cmds.text('Capture OSC to')
+        self.ui_capture_path = cmds.textField(text=self.capture_path, changeCommand=partial(self.set_capture_path), enable=not self.ServerStarted, annotation='Append everything received to this file with its arrival times, so that it can be replayed with Tools/osc_replay.py (empty does not capture)')
+        cmds.text('Stream take to')
+        self.ui_take_path = cmds.textField(text=self.take_path, changeCommand=partial(self.set_take_path), enable=not self.ServerStarted, annotation='Stream the received motion to a take in this directory while receiving, so that it can be baked later in any of the NI mate plugins (empty does not stream)')
         cmds.setParent(upLevel=True)
         
         self.nullsbox = cmds.checkBox( value=self.create, label='Create locators based on received data', changeCommand=partial(self.set_create) )
@@ -293,6 +1464,8 @@ class DelicodeNImatePreferences():
         self.rootbox = cmds.checkBox(value=self.createRoot, label='Parent locators to a root object', changeCommand=partial(self.set_createRoot))
         
         
+        self.bakeButton = cmds.button(label='Bake Take...', command=partial(self.bake_take), enable=not self.ServerStarted, annotation='Key the motion of a take streamed to disk on the locators named after its joints, starting from the current time')
+
         if self.ServerStarted:
             self.receiveButton = cmds.button( label='Stop Receiving', command=partial(self.toggle_server) )
         else:
@@ -315,15 +1488,76 @@ class DelicodeNImatePreferences():
     def set_scaling(self, arg=None):
         self.scaling = cmds.floatField(self.ui_scaling, query=True, value=True)
 
+    def set_jitter_delay(self, arg=None):
+        self.jitter_delay = cmds.intField(self.ui_jitter_delay, query=True, value=True)
+
+    def set_extra_ports(self, arg=None):
+        self.extra_ports = cmds.textField(self.ui_extra_ports, query=True, text=True)
+
+    def set_prediction(self, arg=None):
+        self.prediction = cmds.intField(self.ui_prediction, query=True, value=True)
+
+    def set_refresh_rate(self, arg=None):
+        self.refresh_rate = cmds.intField(self.ui_refresh_rate, query=True, value=True)
+
+    def set_record_flush(self, arg=None):
+        self.record_flush = cmds.intField(self.ui_record_flush, query=True, value=True)
+
+    def set_capture_path(self, arg=None):
+        self.capture_path = cmds.textField(self.ui_capture_path, query=True, text=True)
+
+    def set_take_path(self, arg=None):
+        self.take_path = cmds.textField(self.ui_take_path, query=True, text=True)
+
+    def bake_take(self, arg=None):
+        if numpy is None:
+            print("-> Delicode NI mate receiver needs NumPy to bake a take")
+            return
+
+        paths = cmds.fileDialog2(fileMode=3, caption='Bake NI mate take')
+        if not paths:
+            return
+
+        scene_index = SceneIndex()
+
+        try:
+            bake_take(paths[0], scene_index, self.scaling, self.create, self.root_name if self.createRoot else None)
+        except (OSError, ValueError) as e:
+            print("-> Delicode NI mate receiver couldn't bake the take: " + str(e))
+        finally:
+            scene_index.remove_callbacks()
+
     def toggle_server(self, arg=None):
         if self.ServerStarted:
             self.ServerStarted = False
-            self.timer.stop()
-            del self.timer
+            self.scheduler.stop()
+            print("-> Delicode NI mate receiver scheduler: " + self.scheduler.stats())
+            del self.scheduler
             del self.receiver
+            self.recorder.end_take()
+            del self.recorder
+            self.scene_index.remove_callbacks()
+            del self.scene_index
+
+            if self.capture is not None:
+                self.capture.close()
+                print("-> Delicode NI mate receiver captured " + self.capture.stats())
+                self.capture = None
+
+            if self.take is not None:
+                self.take.close()
+                print("-> Delicode NI mate receiver streamed " + self.take.stats())
+                self.take = None
             
             if cmds.window(self.winName, exists=True):
                 cmds.intField(self.ui_oscport, edit=True, enable=True)
+                cmds.intField(self.ui_jitter_delay, edit=True, enable=True)
+                cmds.intField(self.ui_prediction, edit=True, enable=True)
+                cmds.intField(self.ui_record_flush, edit=True, enable=True)
+                cmds.textField(self.ui_extra_ports, edit=True, enable=True)
+                cmds.textField(self.ui_capture_path, edit=True, enable=True)
+                cmds.textField(self.ui_take_path, edit=True, enable=True)
+                cmds.button(self.bakeButton, edit=True, enable=True)
                 cmds.button(self.receiveButton, edit=True, label='Start Receiving')
             
             for name in cmds.lsUI(type='shelfButton'):
@@ -331,12 +1565,57 @@ class DelicodeNImatePreferences():
                     cmds.setParent('MayaWindow')
                     cmds.shelfButton(name, edit=True, enableBackground=False)
         else:
-            self.receiver = NImateReceiver(self.osc_port)
-            self.timer = TimerObj(self.timer_exec)
+            ports = [self.osc_port]
+
+            for port in self.extra_ports.replace(",", " ").split():
+                try:
+                    ports.append(int(port))
+                except ValueError:
+                    print("-> Delicode NI mate receiver ignoring invalid port: " + port)
+
+            # Loaded up front, so a missing plug-in is reported when starting
+            load_undo_plugin()
+
+            # Shared by the receivers, so there's one set of callbacks
+            self.scene_index = SceneIndex()
+            self.recorder = TakeRecorder(self.scene_index, self.record_flush)
+            receivers = []
+
+            if self.capture_path != "":
+                try:
+                    self.capture = PacketCapture(self.capture_path)
+                except OSError as e:
+                    print("-> Delicode NI mate receiver couldn't open the capture file: %s" % e)
+
+            if self.take_path != "":
+                try:
+                    self.take = TakeWriter(self.take_path, "Maya", lambda v: (v[0], v[1], v[2]), lambda q: (q.w, q.x, q.y, q.z))
+                except OSError as e:
+                    print("-> Delicode NI mate receiver couldn't create the take: %s" % e)
+
+            for i, port in enumerate(ports):
+                # The joints from the additional ports are named sensor2_..., sensor3_...
+                prefix = "sensor" + str(i+1) + "_" if i > 0 else ""
+                receivers.append(NImateReceiver(port, self.scene_index, self.max_packets, self.recv_buffer_size, self.jitter_delay/1000.0, self.prediction/1000.0, prefix, self.capture, self.take))
+
+            if len(receivers) == 1:
+                self.receiver = receivers[0]
+            else:
+                self.receiver = NImateMultiReceiver(receivers)
+            # The jitter buffer interpolates between frames, so it's also
+            # updated when no new frame has arrived
+            self.scheduler = SyncScheduler(receivers, self.timer_exec, 1.0/max(self.refresh_rate, 30), self.jitter_delay > 0)
             self.ServerStarted = True
             
             if cmds.window(self.winName, exists=True):
                 cmds.intField(self.ui_oscport, edit=True, enable=False)
+                cmds.intField(self.ui_jitter_delay, edit=True, enable=False)
+                cmds.intField(self.ui_prediction, edit=True, enable=False)
+                cmds.intField(self.ui_record_flush, edit=True, enable=False)
+                cmds.textField(self.ui_extra_ports, edit=True, enable=False)
+                cmds.textField(self.ui_capture_path, edit=True, enable=False)
+                cmds.textField(self.ui_take_path, edit=True, enable=False)
+                cmds.button(self.bakeButton, edit=True, enable=False)
                 cmds.button(self.receiveButton, edit=True, label='Stop Receiving')
             
             for name in cmds.lsUI(type='shelfButton'):
@@ -349,8 +1628,27 @@ class DelicodeNImatePreferences():
 
     
     def timer_exec(self):
-        if self.ServerStarted:
-            self.receiver.run(self.create, self.record, self.scaling, self.createRoot, self.root_name)
+        if not self.ServerStarted:
+            return
+
+        packets = self.scheduler.take()
+        if len(packets) == 1:
+            packets = packets[self.receiver]
+        record = self.recorder if self.record else None
+
+        # The transforms are set through the API, so the updates themselves
+        # don't grow the undo queue. Created locators are pushed with the
+        # NImateUndo command as they're created, and the keys as one step
+        # when the take ends.
+        self.receiver.run(self.create, record, self.scaling, self.createRoot, self.root_name, packets, False)
+
+        now = time.perf_counter()
+        if self.refresh_rate <= 0 or now - self.last_refresh >= 1.0/self.refresh_rate:
+            cmds.refresh(force=True)
+            self.last_refresh = now
+
+        if self.recorder.due():
+            self.recorder.flush()
 
 def showPreferences():
     global preferences
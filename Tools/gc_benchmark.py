@@ -0,0 +1,168 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Garbage collector pressure of frame assembly: the old path that parses
+# each frame into new dicts of new Vector / Quaternion (or MQuaternion)
+# objects against the pooled path that updates reused joint records.
+#
+# For each path it reports the time per frame, the number of objects
+# tracked by the garbage collector that a frame allocates and keeps alive
+# until the next frame replaces it, and how many generation 0 collections
+# ran per 1000 frames.
+#
+# Outside the host application the math types aren't available, so small
+# __slots__ classes stand in for them. They're allocated and tracked like
+# the real ones, which is all this benchmark measures.
+#
+# Usage: python gc_benchmark.py [--plugin blender|maya] [--frames N] [--users N]
+
+import argparse
+import gc
+import time
+import types
+
+import plugin_loader
+from osc_benchmark import JOINTS, osc_message
+
+class Vector():
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self.x, self.y, self.z = values
+
+    def copy(self):
+        return Vector((self.x, self.y, self.z))
+
+class Quaternion():
+    __slots__ = ("w", "x", "y", "z")
+
+    def __init__(self, values=(1.0, 0.0, 0.0, 0.0)):
+        self.w, self.x, self.y, self.z = values
+
+    def copy(self):
+        return Quaternion((self.w, self.x, self.y, self.z))
+
+class MQuaternion():
+    __slots__ = ("x", "y", "z", "w")
+
+    def __init__(self, *args):
+        if len(args) == 1:
+            args = (args[0].x, args[0].y, args[0].z, args[0].w)
+        self.x, self.y, self.z, self.w = args if len(args) == 4 else (0.0, 0.0, 0.0, 1.0)
+
+def load_receiver(plugin):
+    namespace = plugin_loader.load(plugin, ["OSC", "JointRecord", "JointPool", "NImateReceiver"])
+    namespace.setdefault("Vector", Vector)
+    namespace.setdefault("Quaternion", Quaternion)
+    namespace.setdefault("om", types.SimpleNamespace(MQuaternion=MQuaternion))
+
+    # Only the parsing methods are used, so the receiver is created
+    # without its socket
+    class Receiver(namespace["NImateReceiver"]):
+        def __init__(self):
+            pass
+
+        def __del__(self):
+            pass
+
+    return (namespace["OSC"], namespace["JointPool"], Receiver())
+
+def measure(assemble, frames):
+    """Runs assemble for each frame and returns the time per frame in
+    microseconds, the tracked objects alive at the end of a frame and the
+    generation 0 collections per 1000 frames."""
+    collections = [0]
+
+    def count_collections(phase, info):
+        if phase == "start" and info["generation"] == 0:
+            collections[0] += 1
+
+    # Warm up the pools and caches
+    for frame in frames[:10]:
+        assemble(frame)
+
+    # With the collector disabled the generation 0 count goes up for every
+    # tracked object allocated and down for every one freed. The padding
+    # keeps it above zero so that frees are always counted.
+    gc.collect()
+    gc.disable()
+    padding = [[] for i in range(10000)]
+    allocated = 0
+
+    for frame in frames:
+        before = gc.get_count()[0]
+        result = assemble(frame)
+        allocated += gc.get_count()[0] - before
+        del result
+
+    gc.enable()
+    del padding
+    gc.collect()
+
+    gc.callbacks.append(count_collections)
+    start = time.perf_counter()
+
+    for frame in frames:
+        assemble(frame)
+
+    elapsed = time.perf_counter() - start
+    gc.callbacks.remove(count_collections)
+
+    return (1e6 * elapsed / len(frames), allocated / len(frames), 1000.0 * collections[0] / len(frames))
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame assembly garbage collector benchmark")
+    parser.add_argument("--plugin", default="blender", choices=["blender", "maya"])
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1, help="skeletons per frame")
+    args = parser.parse_args()
+
+    OSC, JointPool, receiver = load_receiver(args.plugin)
+
+    values = [0.1 * i for i in range(7)]
+    datagrams = [osc_message("/user%d_%s" % (user, joint), *values) for user in range(args.users) for joint in JOINTS]
+    datagrams.append(osc_message("/NI_mate_sync", 1.0))
+    frames = [datagrams] * args.frames
+
+    def assemble_dicts(frame):
+        location_dict = {}
+        rotation_dict = {}
+        for data in frame:
+            receiver.parse_message(OSC.decodeOSC(data), location_dict, rotation_dict)
+        return (location_dict, rotation_dict)
+
+    pool = JointPool()
+
+    def assemble_pooled(frame):
+        pool.begin()
+        for data in frame:
+            receiver.parse_pooled(OSC.decodeOSC(data), pool)
+        return pool
+
+    old = assemble_dicts(frames[0])
+    new = assemble_pooled(frames[0])
+    assert sorted(old[0]) == sorted(new.location_dict) and sorted(old[1]) == sorted(new.rotation_dict)
+
+    print("%d joints per frame, %s plugin" % (len(datagrams) - 1, args.plugin))
+    print("%-8s %12s %16s %18s" % ("path", "us/frame", "objects/frame", "gen0 GCs/1000"))
+
+    for name, assemble in (("dicts", assemble_dicts), ("pooled", assemble_pooled)):
+        print("%-8s %12.2f %16.1f %18.2f" % ((name,) + measure(assemble, frames)))
+
+if __name__ == "__main__":
+    main()
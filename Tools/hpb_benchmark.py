@@ -0,0 +1,248 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Correctness and speed of the batched quaternion to HPB conversion and
+# rotation unwrapping of the Cinema 4D receiver.
+#
+# c4d.utils.MatrixToHPB isn't available outside Cinema 4D, so the batched
+# angles are checked against rotations with known answers: each is built
+# from H, P and B angles with the HPBToMatrix convention, and MatrixToHPB
+# returns those angles while the pitch is inside -90..90 degrees, with -180
+# and 180 degrees the same angle. At gimbal lock only the difference or
+# sum of heading and bank is defined, and those cases expect a heading of
+# 0 with the whole turn in the bank. That split is the one convention the
+# known answers can't settle, so the batched path stays behind
+# RECEIVE_BATCH_HPB until it also matches a fixture of real output: a JSON
+# list of [[w, x, y, z], [h, p, b]] pairs made in Cinema 4D's script
+# manager with MatrixToHPB of the receiver's quatToMat, checked with
+# --fixture. The angles are also checked to rebuild the receiver's own
+# quatToMat for random rotations. The NumPy unwrapping is checked against
+# the per key loops it replaces, and matToQuat is checked on every branch
+# by converting back and forth.
+#
+# The timings compare the batch to matrix_to_hpb, a scalar port of
+# MatrixToHPB written for this benchmark, which isn't used as a reference.
+#
+# Usage: python hpb_benchmark.py [--joints N] [--frames N] [--seed N]
+#                                [--fixture FILE]
+
+import argparse
+import json
+import math
+import random
+import time
+import types
+
+import numpy
+
+import plugin_loader
+
+class Vector():
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = x, y, z
+
+class Matrix():
+    __slots__ = ("off", "v1", "v2", "v3")
+
+    def __init__(self, off, v1, v2, v3):
+        self.off, self.v1, self.v2, self.v3 = off, v1, v2, v3
+
+def load_receiver():
+    namespace = plugin_loader.load("c4d", ["quats_to_hpb", "unwrap_angles", "NImateReceiver"])
+    namespace["c4d"] = types.SimpleNamespace(Vector=Vector, Matrix=Matrix)
+    namespace["numpy"] = numpy
+
+    # Only the math methods are used, so the receiver is created without
+    # its socket
+    class Receiver(namespace["NImateReceiver"]):
+        def __init__(self):
+            pass
+
+        def __del__(self):
+            pass
+
+    return (namespace["quats_to_hpb"], namespace["unwrap_angles"], Receiver())
+
+def matrix_to_hpb(m):
+    """Scalar port of MatrixToHPB for the default rotation order, the
+    baseline of the timings."""
+    l = math.sqrt(m.v3.x*m.v3.x + m.v3.z*m.v3.z)
+
+    if l < 1e-9:
+        return (0.0, math.atan2(-m.v3.y, l), math.atan2(-m.v2.x, m.v1.x))
+
+    return (math.atan2(m.v3.x, m.v3.z), math.atan2(-m.v3.y, l), math.atan2(m.v1.y, m.v2.y))
+
+def hpb_to_rows(h, p, b):
+    """Returns the v1, v2 and v3 rows of the HPB rotation H * P * B."""
+    ch, sh = math.cos(h), math.sin(h)
+    cp, sp = math.cos(p), math.sin(p)
+    cb, sb = math.cos(b), math.sin(b)
+
+    return ((ch*cb + sh*sp*sb, cp*sb, -sh*cb + ch*sp*sb),
+            (-ch*sb + sh*sp*cb, cp*cb, sh*sb + ch*sp*cb),
+            (sh*cp, -sp, ch*cp))
+
+def known_rotations():
+    """Returns (group, hpb, expected) triples in degrees: the angles a
+    rotation is built from and the angles MatrixToHPB returns for it."""
+    cases = []
+
+    for h in (-170, -90, -30, 0, 45, 120, 179):
+        for p in (-80, -45, 0, 30, 89):
+            for b in (-150, -60, 0, 10, 90, 175):
+                cases.append(("regular", (h, p, b), (h, p, b)))
+
+    # Headings and banks of a half turn, to either side
+    for h in (180, -180):
+        for b in (180, -180, 0):
+            for p in (0, 30, -60):
+                cases.append(("180 degrees", (h, p, b), (h, p, b)))
+                cases.append(("180 degrees", (b, p, h), (b, p, h)))
+
+    # Looking straight up the bank turns against the heading, and straight
+    # down with it
+    for h, b in ((0, 30), (40, 0), (25, -60), (-170, 100), (180, 0)):
+        cases.append(("gimbal lock", (h, 90, b), (0, 90, b - h)))
+        cases.append(("gimbal lock", (h, -90, b), (0, -90, h + b)))
+
+    return cases
+
+def unwrap_loop(samples, last):
+    """The per key unwrapping the batch replaces."""
+    last = list(last)
+    result = []
+
+    for values in samples:
+        values = list(values)
+
+        for i in range(3):
+            if last[i] is not None:
+                while values[i] - last[i] > math.pi:
+                    values[i] = values[i] - 2.0*math.pi
+
+                while values[i] - last[i] < -math.pi:
+                    values[i] = values[i] + 2.0*math.pi
+
+            last[i] = values[i]
+
+        result.append(values)
+
+    return result
+
+def random_quat(rng):
+    values = [rng.gauss(0.0, 1.0) for i in range(4)]
+    length = math.sqrt(sum(v*v for v in values))
+    return tuple(v/length for v in values)
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        function()
+    return 1e6 * (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Cinema 4D HPB conversion benchmark")
+    parser.add_argument("--joints", type=int, default=15, help="rotations per frame")
+    parser.add_argument("--frames", type=int, default=3000, help="frames in a recorded take")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixture", help="JSON of quaternions and their MatrixToHPB angles from Cinema 4D")
+    args = parser.parse_args()
+
+    quats_to_hpb, unwrap_angles, receiver = load_receiver()
+    rng = random.Random(args.seed)
+
+    # Random rotations and the gimbal cases looking straight up and down
+    quats = [random_quat(rng) for i in range(10000)]
+    for angle in (0.0, 0.7, -2.0, math.pi):
+        for pitch in (0.5*math.pi, -0.5*math.pi):
+            q_p = (math.cos(0.5*pitch), math.sin(0.5*pitch), 0.0, 0.0)
+            q_b = (math.cos(0.5*angle), 0.0, 0.0, math.sin(0.5*angle))
+            quats.append(receiver.quatMul(q_b, q_p))
+
+    # The known rotations, as quaternions through the receiver's own
+    # matToQuat, which is checked below
+    groups = {}
+    for group, hpb, expected in known_rotations():
+        rows = hpb_to_rows(*[math.radians(a) for a in hpb])
+        q = receiver.matToQuat(Matrix(Vector(), *[Vector(*row) for row in rows]))
+        groups.setdefault(group, []).append((q, [math.radians(a) for a in expected]))
+
+    for group, cases in groups.items():
+        converted = quats_to_hpb([q for q, expected in cases])
+        difference = converted - numpy.array([expected for q, expected in cases])
+        difference = numpy.abs(numpy.arctan2(numpy.sin(difference), numpy.cos(difference)))
+        print("batch vs known MatrixToHPB, %s (%d rotations), max difference: %.3g" % (group, len(cases), difference.max()))
+
+    batch = quats_to_hpb(quats)
+
+    if args.fixture:
+        with open(args.fixture) as f:
+            pairs = json.load(f)
+        expected = numpy.array([hpb for q, hpb in pairs])
+        converted = quats_to_hpb([q for q, hpb in pairs])
+        print("batch vs Cinema 4D MatrixToHPB (%d rotations), max difference: %.3g" % (len(pairs), numpy.abs(converted - expected).max()))
+
+    # The angles describe the same rotation as quatToMat
+    error = 0.0
+    for q, hpb in zip(quats, batch.tolist()):
+        m = receiver.quatToMat(q)
+        for row, v in zip(hpb_to_rows(*hpb), (m.v1, m.v2, m.v3)):
+            error = max(error, abs(row[0] - v.x), abs(row[1] - v.y), abs(row[2] - v.z))
+    print("HPB round trip to quatToMat, max difference: %.3g" % error)
+
+    # Rotations of about 180 degrees around each axis take the non-trace
+    # branches of matToQuat
+    error = 0.0
+    branches = [(0.01, 1.0, 0.02, 0.03), (0.01, 0.02, 1.0, 0.03), (0.01, 0.02, 0.03, 1.0)]
+    for q in quats + branches:
+        length = math.sqrt(sum(v*v for v in q))
+        q = tuple(v/length for v in q)
+        r = receiver.matToQuat(receiver.quatToMat(q))
+        sign = 1.0 if sum(a*b for a, b in zip(q, r)) >= 0 else -1.0
+        error = max(error, max(abs(a - sign*b) for a, b in zip(q, r)))
+    print("matToQuat(quatToMat(q)), max difference: %.3g" % error)
+
+    # A take of a joint turning steadily, wrapped to -pi..pi, with the key
+    # before it at several turns
+    angles = numpy.cumsum(numpy.array([[rng.uniform(-0.5, 0.5) for i in range(3)] for f in range(args.frames)]), axis=0)
+    wrapped = numpy.arctan2(numpy.sin(angles), numpy.cos(angles)).tolist()
+    for last in ([None, None, None], [4.0*math.pi, -6.0*math.pi, 0.3]):
+        loop = numpy.array(unwrap_loop(wrapped, last))
+        batch = unwrap_angles(wrapped, [numpy.nan if v is None else v for v in last])
+        print("batch vs loop unwrap, max difference: %.3g" % numpy.abs(batch - loop).max())
+
+    frame = quats[:args.joints]
+    take = numpy.array([quats[(f*args.joints) % 9000:(f*args.joints) % 9000 + args.joints] for f in range(args.frames)])
+
+    print()
+    print("%-28s %14s %14s" % ("", "scalar (us)", "batch (us)"))
+    print("%-28s %14.1f %14.1f" % ("frame of %d joints" % args.joints,
+                                   timed(lambda: [matrix_to_hpb(receiver.quatToMat(q)) for q in frame], 200),
+                                   timed(lambda: quats_to_hpb(frame).tolist(), 200)))
+    print("%-28s %14.1f %14.1f" % ("take of %d frames" % args.frames,
+                                   timed(lambda: [matrix_to_hpb(receiver.quatToMat(q)) for q in take.reshape(-1, 4).tolist()], 3),
+                                   timed(lambda: quats_to_hpb(take), 3)))
+    print("%-28s %14.1f %14.1f" % ("unwrap of %d keys" % args.frames,
+                                   timed(lambda: unwrap_loop(wrapped, [0.0, 0.0, 0.0]), 3),
+                                   timed(lambda: unwrap_angles(wrapped, [0.0, 0.0, 0.0]).tolist(), 3)))
+
+if __name__ == "__main__":
+    main()
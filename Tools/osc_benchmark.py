@@ -0,0 +1,92 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Micro-benchmark comparing OSC argument decoding through the per-typetag
+# reader table against the cached, typetag-compiled struct.Struct path.
+#
+# Usage: python osc_benchmark.py [--plugin blender|blender279|maya|c4d] [--frames N]
+
+import argparse
+import struct
+import timeit
+
+import plugin_loader
+
+JOINTS = ["Head", "Neck", "Torso", "Waist",
+          "Left_Collar", "Left_Shoulder", "Left_Elbow", "Left_Wrist", "Left_Hand", "Left_Fingertip",
+          "Right_Collar", "Right_Shoulder", "Right_Elbow", "Right_Wrist", "Right_Hand", "Right_Fingertip",
+          "Left_Hip", "Left_Knee", "Left_Ankle", "Left_Foot",
+          "Right_Hip", "Right_Knee", "Right_Ankle", "Right_Foot"]
+
+def osc_string(s):
+    data = s.encode("utf-8") + b"\x00"
+    return data + b"\x00" * (-len(data) % 4)
+
+def osc_message(address, *floats):
+    return osc_string(address) + osc_string("," + "f" * len(floats)) + struct.pack(">%df" % len(floats), *floats)
+
+def skeleton_frame(typetag_count):
+    """Returns the datagrams NI mate sends for one skeleton frame of the
+    given format (3 for locations, 4 for rotations, 7 for both)."""
+    values = [0.1 * i for i in range(typetag_count)]
+    messages = [osc_message("/" + joint, *values) for joint in JOINTS]
+    messages.append(osc_message("/NI_mate_sync", 1.0))
+    return messages
+
+def main():
+    parser = argparse.ArgumentParser(description="OSC decoding micro-benchmark")
+    parser.add_argument("--plugin", default="blender", choices=sorted(plugin_loader.PLUGINS))
+    parser.add_argument("--frames", type=int, default=2000)
+    args = parser.parse_args()
+
+    OSC = plugin_loader.load(args.plugin, ["OSC"])["OSC"]
+
+    def decode_table_driven(data):
+        data = memoryview(data)
+        address, offset = OSC.readByte(data, 0)
+        typetags, offset = OSC.readByte(data, offset)
+        decoded = [address, typetags]
+        OSC.decodeArguments(data, offset, typetags, decoded)
+        return decoded
+
+    print("%-10s %12s %12s %8s" % ("typetags", "table (us)", "struct (us)", "speedup"))
+
+    for count in (3, 4, 7):
+        frame = skeleton_frame(count)
+
+        for data in frame:
+            assert decode_table_driven(data) == OSC.decodeOSC(data)
+
+        def run_table():
+            for data in frame:
+                decode_table_driven(data)
+
+        def run_struct():
+            for data in frame:
+                OSC.decodeOSC(data)
+
+        table = min(timeit.repeat(run_table, number=args.frames, repeat=3))
+        compiled = min(timeit.repeat(run_struct, number=args.frames, repeat=3))
+
+        per_frame = 1e6 / args.frames
+        print("%-10s %12.2f %12.2f %7.2fx" % ("," + "f" * count, table * per_frame, compiled * per_frame, table / compiled))
+
+    print(OSC.compileTypetags.cache_info())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Replays an OSC capture written by the capture mode of the receivers
+# (PacketCapture in the plugins) over UDP. The datagrams are sent at their
+# captured times, scaled by --speed, or as fast as possible with --fast,
+# each to the port it was received on unless --port is given. The sessions
+# appended to a capture are played one after the other.
+#
+# Sleeping is only accurate to about a millisecond, so the last
+# millisecond before each datagram is waited out in a busy loop. The
+# lateness of the datagrams against their schedule is reported at the end.
+#
+# Usage: python osc_replay.py CAPTURE [--host IP] [--port N]
+#                             [--speed X | --fast] [--loop N]
+
+import argparse
+import socket
+import time
+
+import plugin_loader
+
+PacketCapture = plugin_loader.load("blender", ["PacketCapture"])["PacketCapture"]
+
+def read_capture(path):
+    """Yields the time, port and data of each datagram in a capture. The
+    times of each session continue from the end of the previous one."""
+    with open(path, "rb") as f:
+        if f.read(len(PacketCapture.MAGIC)) != PacketCapture.MAGIC:
+            raise ValueError("%s isn't an NI mate capture" % path)
+
+        offset = 0.0
+        last = 0.0
+
+        while True:
+            header = f.read(PacketCapture.ENTRY.size)
+
+            # A capture cut off while it was written ends in a partial entry
+            if len(header) < PacketCapture.ENTRY.size:
+                return
+
+            seconds, port, size = PacketCapture.ENTRY.unpack(header)
+
+            if size == 0:
+                # The start of a session, its time is the wall clock time
+                offset = last
+                continue
+
+            data = f.read(size)
+            if len(data) < size:
+                return
+
+            last = offset + seconds
+            yield (last, port, data)
+
+def replay(entries, sock, host, port, speed, start, stats):
+    """Sends the entries on the schedule starting at start and returns the
+    capture time of the last one."""
+    last = 0.0
+
+    for seconds, original_port, data in entries:
+        if speed > 0:
+            due = start + seconds/speed
+            delay = due - time.perf_counter()
+
+            if delay > 0.002:
+                time.sleep(delay - 0.001)
+
+            while time.perf_counter() < due:
+                pass
+
+            late = time.perf_counter() - due
+            stats["late"] += late
+            stats["max_late"] = max(stats["max_late"], late)
+
+        sock.sendto(data, (host, port or original_port))
+        stats["packets"] += 1
+        stats["bytes"] += len(data)
+        last = seconds
+
+    return last
+
+def main():
+    parser = argparse.ArgumentParser(description="NI mate OSC capture replayer")
+    parser.add_argument("capture")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="send everything to this port instead of the captured ones")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 2 plays twice as fast")
+    parser.add_argument("--fast", action="store_true", help="send as fast as possible")
+    parser.add_argument("--loop", type=int, default=1, help="times the capture is played")
+    args = parser.parse_args()
+
+    speed = 0.0 if args.fast else args.speed
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    stats = {"packets": 0, "bytes": 0, "late": 0.0, "max_late": 0.0}
+
+    start = time.perf_counter()
+    offset = 0.0
+
+    try:
+        for i in range(args.loop):
+            entries = ((seconds + offset, port, data) for seconds, port, data in read_capture(args.capture))
+            offset = replay(entries, sock, args.host, args.port, speed, start, stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+    elapsed = time.perf_counter() - start
+    print("%d packets, %d bytes in %.2f s (%.0f packets/s)" % (stats["packets"], stats["bytes"], elapsed, stats["packets"] / max(elapsed, 1e-9)))
+
+    if speed > 0 and stats["packets"] > 0:
+        print("lateness: mean %.3f ms, max %.3f ms" % (1000 * stats["late"] / stats["packets"], 1000 * stats["max_late"]))
+
+if __name__ == "__main__":
+    main()
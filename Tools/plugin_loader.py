@@ -0,0 +1,62 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Loads classes and functions from the NI mate plugins without the host
+# application (Blender, Maya or Cinema 4D) so that the pure Python parts,
+# such as the OSC decoder, can be benchmarked and tested from a normal
+# Python interpreter.
+
+import ast
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLUGINS = {
+    "blender": os.path.join(ROOT, "Blender", "animation_delicode_ni_mate_tools.py"),
+    "blender279": os.path.join(ROOT, "Blender", "animation_delicode_ni_mate_tools_279.py"),
+    "maya": os.path.join(ROOT, "Maya", "scripts", "NImateReceiverForMaya.py"),
+    "c4d": os.path.join(ROOT, "Cinema4D", "Delicode_NI_mate_receiver", "Delicode_NI_mate_receiver.pyp"),
+}
+
+def load(plugin, names):
+    """Executes the module level imports and the named top level
+    definitions of a plugin and returns the resulting namespace. Imports of
+    host application modules that aren't available are skipped."""
+    path = PLUGINS.get(plugin, plugin)
+
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+
+    namespace = {"__name__": "nimate_plugin", "__file__": path}
+
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module([node], []), path, "exec"), namespace)
+            except ImportError:
+                pass
+        elif isinstance(node, (ast.ClassDef, ast.FunctionDef)) and node.name in names:
+            exec(compile(ast.Module([node], []), path, "exec"), namespace)
+        elif isinstance(node, ast.Assign) and any(getattr(t, "id", None) in names for t in node.targets):
+            exec(compile(ast.Module([node], []), path, "exec"), namespace)
+
+    missing = [name for name in names if name not in namespace]
+    if missing:
+        raise NameError("%s doesn't define %s" % (path, ", ".join(missing)))
+
+    return namespace
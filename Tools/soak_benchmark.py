@@ -0,0 +1,392 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Soak test of the receivers: a sender thread streams synthetic skeleton
+# frames over UDP to a real NImateReceiver while the main loop runs it at
+# the update rate, for an hour by default. The resident memory of the
+# process is sampled at a fixed interval, and the growth after the warm-up
+# is reported per hour, so leaks in the receive path show up as a steady
+# slope instead of noise.
+#
+# The math types and the objects the joints are applied to are small
+# stand-ins, since bpy, mathutils and maya aren't available outside the
+# applications. With --maya the Maya receiver records a take with its real
+# TakeRecorder, flushed every --flush seconds and ended every --take
+# seconds, into stand-in curves. The stand-in NImateUndo command keeps what
+# it's given like Maya's undo queue does, and the entries and the changes
+# they hold are reported with the memory, so it shows that the undo queue
+# grows by one bounded step per take and not with every update or flush.
+# The memory of Maya itself, such as the keys in the curves, isn't
+# measured.
+#
+# Usage: python soak_benchmark.py [--duration S] [--interval S] [--fps N]
+#                                 [--users N] [--threaded] [--jitter MS]
+#                                 [--prediction MS] [--maya] [--flush S]
+#                                 [--take S]
+
+import argparse
+import math
+import os
+import socket
+import threading
+import time
+import types
+
+import plugin_loader
+from osc_benchmark import JOINTS, osc_message
+
+class Vector():
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self.x, self.y, self.z = values
+
+    def copy(self):
+        return Vector((self.x, self.y, self.z))
+
+    def lerp(self, other, t):
+        return Vector((self.x + (other.x-self.x)*t, self.y + (other.y-self.y)*t, self.z + (other.z-self.z)*t))
+
+    def __rmul__(self, scale):
+        return Vector((scale*self.x, scale*self.y, scale*self.z))
+
+class Quaternion():
+    __slots__ = ("w", "x", "y", "z")
+
+    def __init__(self, values=(1.0, 0.0, 0.0, 0.0), angle=None):
+        if angle is not None:
+            # Axis and angle, like mathutils
+            axis = values
+            length = math.sqrt(sum(c*c for c in axis)) or 1.0
+            s = math.sin(0.5*angle) / length
+            values = (math.cos(0.5*angle), axis[0]*s, axis[1]*s, axis[2]*s)
+        self.w, self.x, self.y, self.z = values
+
+    def copy(self):
+        return Quaternion((self.w, self.x, self.y, self.z))
+
+    def slerp(self, other, t):
+        # mathutils only accepts factors from 0 to 1, so the stand-in
+        # doesn't hide callers that extrapolate with it
+        if not 0.0 <= t <= 1.0:
+            raise ValueError("Quaternion.slerp(): interpolation factor must be between 0 and 1")
+
+        # Normalized lerp is close enough for a memory test
+        values = [a + (b-a)*t for a, b in zip((self.w, self.x, self.y, self.z), (other.w, other.x, other.y, other.z))]
+        length = sum(v*v for v in values) ** 0.5 or 1.0
+        return Quaternion([v/length for v in values])
+
+    def __matmul__(self, other):
+        a, b = self, other
+        return Quaternion((a.w*b.w - a.x*b.x - a.y*b.y - a.z*b.z,
+                           a.w*b.x + a.x*b.w + a.y*b.z - a.z*b.y,
+                           a.w*b.y - a.x*b.z + a.y*b.w + a.z*b.x,
+                           a.w*b.z + a.x*b.y - a.y*b.x + a.z*b.w))
+
+    def inverted(self):
+        n = self.w*self.w + self.x*self.x + self.y*self.y + self.z*self.z or 1.0
+        return Quaternion((self.w/n, -self.x/n, -self.y/n, -self.z/n))
+
+    def negate(self):
+        self.w, self.x, self.y, self.z = -self.w, -self.x, -self.y, -self.z
+
+    def to_axis_angle(self):
+        w = max(-1.0, min(1.0, self.w))
+        s = math.sqrt(max(0.0, 1.0 - w*w))
+        if s < 1e-9:
+            return ((1.0, 0.0, 0.0), 0.0)
+        return ((self.x/s, self.y/s, self.z/s), 2.0*math.acos(w))
+
+class MQuaternion():
+    __slots__ = ("x", "y", "z", "w")
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, w=1.0):
+        if isinstance(x, MQuaternion):
+            x, y, z, w = x.x, x.y, x.z, x.w
+        self.x, self.y, self.z, self.w = x, y, z, w
+
+def maya_slerp(a, b, t):
+    return MQuaternion(*[p + (q-p)*t for p, q in zip((a.x, a.y, a.z, a.w), (b.x, b.y, b.z, b.w))])
+
+class MVector():
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = x, y, z
+
+class MEulerRotation():
+    def __init__(self):
+        self.x = self.y = self.z = 0.0
+
+    def setToClosestSolution(self, other):
+        pass
+
+class MTime():
+    def __init__(self, value=0.0, unit=None):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+    @staticmethod
+    def uiUnit():
+        return None
+
+class Plug():
+    def __init__(self):
+        self.curve = None
+
+class MFnTransform():
+    """A locator, whose plugs remember their curve."""
+    def __init__(self):
+        self.translation = MVector()
+        self.rotation = MQuaternion()
+        self.plugs = {}
+
+    def setTranslation(self, vector, space):
+        self.translation = vector
+
+    def getTranslation(self, space):
+        return self.translation
+
+    def setRotationQuaternion(self, x, y, z, w):
+        self.rotation = MQuaternion(x, y, z, w)
+
+    def getRotation(self, euler):
+        euler.x, euler.y, euler.z = self.rotation.x, self.rotation.y, self.rotation.z
+
+    def findPlug(self, attribute):
+        return self.plugs.setdefault(attribute, Plug())
+
+class MDGModifier():
+    def doIt(self):
+        pass
+
+    def undoIt(self):
+        pass
+
+class MAnimCurveChange():
+    def undoIt(self):
+        pass
+
+    def redoIt(self):
+        pass
+
+class MFnAnimCurve():
+    """Counts the keys instead of keeping them, the curves' memory belongs
+    to Maya and isn't part of the test."""
+    kTangentGlobal = 0
+    keys = 0
+
+    def create(self, plug, modifier):
+        plug.curve = object()
+
+    def setObject(self, curve):
+        pass
+
+    def addKeys(self, times, values, tangent_in, tangent_out, keep, change):
+        MFnAnimCurve.keys += len(times)
+
+class MAnimUtil():
+    @staticmethod
+    def findAnimation(plug, curves):
+        if plug.curve is None:
+            return False
+        curves.append(plug.curve)
+        return True
+
+class MayaScene():
+    """Stands in for the SceneIndex, creating missing locators as one undo
+    step like SceneIndex.prepare does."""
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.transforms = {}
+
+    def get(self, name):
+        return self.transforms.get(name)
+
+    def prepare(self, names, create, root_name=None):
+        missing = [name for name in names if name not in self.transforms]
+        if missing and create:
+            for name in missing:
+                self.transforms[name] = MFnTransform()
+            modifier = MDGModifier()
+            self.namespace["push_undo"]([(modifier.undoIt, modifier.doIt)])
+
+def resident_memory():
+    """Returns the resident set size of the process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak, which still shows steady growth
+        import resource
+        import sys
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def load_receiver():
+    namespace = plugin_loader.load("blender", ["OSC", "DatagramReader", "FrameBuffer", "JitterBuffer", "Predictor",
+                                               "JointRecord", "JointPool", "NImateReceiver", "extrapolate_quaternion", "take_recorder", "reset_locrot"])
+    namespace.setdefault("Vector", Vector)
+    namespace.setdefault("Quaternion", Quaternion)
+    namespace.setdefault("numpy", None)
+    namespace["bpy"] = types.SimpleNamespace(context=types.SimpleNamespace(scene=types.SimpleNamespace(delicode_ni_mate_ip="127.0.0.1")))
+    return namespace["NImateReceiver"]
+
+def load_maya_receiver():
+    """Returns the Maya NImateReceiver and TakeRecorder, and the list the
+    stand-in NImateUndo command appends the changes of each step to."""
+    namespace = plugin_loader.load("maya", ["OSC", "DatagramReader", "JitterBuffer", "Predictor", "JointRecord", "JointPool",
+                                            "NImateReceiver", "TakeRecorder", "lerp", "undo_changes", "undo_plugin",
+                                            "load_undo_plugin", "push_undo", "take_undo"])
+    undo_queue = []
+
+    def NImateUndo():
+        undo_queue.append(namespace["take_undo"]())
+
+    namespace["om"] = types.SimpleNamespace(MQuaternion=MQuaternion, MVector=MVector, MEulerRotation=MEulerRotation,
+                                            MSpace=types.SimpleNamespace(kTransform=0), MObjectArray=list,
+                                            MTimeArray=list, MDoubleArray=list, MTime=MTime, MDGModifier=MDGModifier,
+                                            slerp=maya_slerp)
+    namespace["oma"] = types.SimpleNamespace(MFnAnimCurve=MFnAnimCurve, MAnimUtil=MAnimUtil, MAnimCurveChange=MAnimCurveChange,
+                                             MAnimControl=types.SimpleNamespace(currentTime=lambda: MTime(30.0*time.perf_counter())))
+    namespace["cmds"] = types.SimpleNamespace(NImateUndo=NImateUndo, refresh=lambda force=False: None,
+                                              pluginInfo=lambda name, query=False, loaded=False: True)
+    namespace.setdefault("numpy", None)
+    return (namespace, undo_queue)
+
+def send_loop(port, fps, users, stop_event):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.perf_counter()
+    frame = 0
+
+    while not stop_event.is_set():
+        values = [0.001 * (frame % 1000) + 0.1 * i for i in range(7)]
+
+        for user in range(users):
+            for joint in JOINTS:
+                sock.sendto(osc_message("/user%d_%s" % (user, joint), *values), ("127.0.0.1", port))
+        sock.sendto(osc_message("/NI_mate_sync", 1.0), ("127.0.0.1", port))
+
+        frame += 1
+        delay = start + frame / fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Receiver memory soak test")
+    parser.add_argument("--duration", type=float, default=3600.0, help="seconds")
+    parser.add_argument("--interval", type=float, default=60.0, help="seconds between memory samples")
+    parser.add_argument("--warmup", type=float, default=10.0, help="seconds before the baseline sample")
+    parser.add_argument("--fps", type=float, default=30.0, help="frames sent and updates run per second")
+    parser.add_argument("--users", type=int, default=1, help="skeletons per frame")
+    parser.add_argument("--port", type=int, default=7099)
+    parser.add_argument("--threaded", action="store_true", help="receive in a background thread")
+    parser.add_argument("--jitter", type=float, default=0.0, help="jitter buffer delay in milliseconds")
+    parser.add_argument("--prediction", type=float, default=0.0, help="prediction horizon in milliseconds")
+    parser.add_argument("--maya", action="store_true", help="soak the Maya receiver and its undo steps instead of Blender")
+    parser.add_argument("--flush", type=float, default=1.0, help="seconds between Maya key flushes")
+    parser.add_argument("--take", type=float, default=600.0, help="seconds between the ends of Maya takes")
+    args = parser.parse_args()
+
+    objects = {}
+    applied = [0]
+
+    if args.maya:
+        namespace, undo_queue = load_maya_receiver()
+        scene = MayaScene(namespace)
+        receiver = namespace["NImateReceiver"](args.port, scene, JITTER_DELAY=args.jitter/1000, PREDICTION=args.prediction/1000)
+        recorder = namespace["TakeRecorder"](scene, args.flush)
+        last_take = [time.perf_counter()]
+
+        def update():
+            receiver.run(True, recorder, 10.0, False, "nimate_root", None, False)
+            if recorder.due():
+                recorder.flush()
+            if time.perf_counter() - last_take[0] >= args.take:
+                recorder.end_take()
+                last_take[0] = time.perf_counter()
+            applied[0] = MFnAnimCurve.keys
+
+        header = ("keys", "undo steps", "undo changes")
+        def columns():
+            return (MFnAnimCurve.keys, len(undo_queue), sum(len(step) for step in undo_queue) + len(recorder.changes))
+    else:
+        NImateReceiver = load_receiver()
+        receiver = NImateReceiver(args.port, None, THREADED=args.threaded, JITTER_DELAY=args.jitter/1000, PREDICTION=args.prediction/1000)
+
+        def set_location(objects, ob_name, vec, originals):
+            objects[ob_name] = 10*vec
+            applied[0] += 1
+
+        def set_rotation(objects, ob_name, quat, originals):
+            objects[ob_name] = quat
+            applied[0] += 1
+
+        def update():
+            receiver.run(objects, set_location, set_rotation)
+
+        header = ("joints set",)
+        def columns():
+            return (applied[0],)
+
+    stop_event = threading.Event()
+    sender = threading.Thread(target=send_loop, args=(args.port, args.fps, args.users, stop_event), daemon=True)
+    sender.start()
+
+    start = time.perf_counter()
+    baseline = None
+    next_sample = start + args.warmup
+    updates = 0
+
+    print(("%10s %12s %12s %10s" + " %12s"*len(header)) % (("time (s)", "RSS (MB)", "growth (MB)", "updates") + header))
+
+    try:
+        while True:
+            update()
+            updates += 1
+
+            now = time.perf_counter()
+
+            if now >= next_sample:
+                rss = resident_memory()
+                if baseline is None:
+                    baseline = (now, rss)
+                print(("%10.0f %12.2f %12.2f %10d" + " %12d"*len(header)) % ((now - start, rss / 1e6, (rss - baseline[1]) / 1e6, updates) + columns()), flush=True)
+                next_sample += args.interval
+
+            if now - start >= args.duration:
+                break
+
+            time.sleep(max(0.0, start + updates / args.fps - time.perf_counter()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        sender.join()
+
+    if baseline is not None and now > baseline[0]:
+        rss = resident_memory()
+        print("growth after warm-up: %.2f MB, %.2f MB/hour" % ((rss - baseline[1]) / 1e6, (rss - baseline[1]) / 1e6 * 3600 / (now - baseline[0])))
+
+    del receiver
+
+if __name__ == "__main__":
+    main()